@@ -0,0 +1,492 @@
+"""Performance checks for downloader.py.
+
+    python benchmark.py startup [--budget-ms 50] [--runs 5]
+    python benchmark.py timings FILE [FILE ...]
+    python benchmark.py suite [--sizes 10,50,200] [--jobs 4] [--update-baseline]
+
+`startup` imports downloader under `python -X importtime` several times and
+fails (exit status 1) when the median cumulative import time is over budget.
+`timings` reports stage percentiles over files written by
+`downloader.py --timings`, e.g. several production batches at once.
+`suite` runs the downloader offline against a local stand-in for YouTube:
+a throwaway HTTP server serves playlist and video metadata, synthetic MP3s
+and PNG thumbnails, and a fake yt-dlp extractor for it is registered ahead
+of the real ones. It times playlist listing, downloads (with tagging and
+covers), resume checks, thumbnail fetches and tagging at each batch size,
+saves the results as JSON and compares them with a saved baseline, failing
+when something got slower by more than --tolerance.
+"""
+
+import argparse
+import contextlib
+import http.server
+import io
+import json
+import os
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import parse_qs
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+STARTUP_BUDGET_MS = 50
+RESULTS_DIR = os.path.join(HERE, ".cache", "benchmark")
+# MPEG-1 Layer III, 128 kbit/s, 44.1 kHz frame header; frames are 417 bytes
+MP3_FRAME = b"\xff\xfb\x90\x64" + bytes(413)
+
+
+def import_times(code="import downloader"):
+    """Run code in a fresh interpreter; return {module: cumulative import ms}."""
+    out = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=HERE,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in out.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        times[name.strip()] = int(cumulative) / 1000.0
+    return times
+
+
+def cli_ms():
+    """Wall time of a complete non-interactive CLI run (--config show)."""
+    start = time.perf_counter()
+    subprocess.run(
+        [sys.executable, os.path.join(HERE, "downloader.py"), "--config", "show"],
+        cwd=HERE,
+        capture_output=True,
+        check=True,
+    )
+    return (time.perf_counter() - start) * 1000
+
+
+def bench_startup(args):
+    runs = [import_times() for _ in range(args.runs)]
+    median = statistics.median(r["downloader"] for r in runs)
+    interpreter = import_times("pass")
+    heaviest = sorted(
+        (ms, name)
+        for name, ms in runs[-1].items()
+        if "." not in name and name not in interpreter and name != "downloader"
+    )[::-1][:5]
+    print(f"import downloader: {median:.1f} ms (median of {args.runs})")
+    for ms, name in heaviest:
+        print(f"  {name:<24} {ms:7.1f} ms")
+    cli = statistics.median(cli_ms() for _ in range(args.runs))
+    print(f"downloader.py --config show: {cli:.1f} ms")
+    if median > args.budget_ms:
+        print(f"FAIL: over the {args.budget_ms} ms startup budget")
+        return 1
+    print(f"OK: within the {args.budget_ms} ms startup budget")
+    return 0
+
+
+def bench_timings(args):
+    import downloader
+    from rich.console import Console
+
+    records = [r for path in args.files for r in downloader.load_timings(path)]
+    if not records:
+        print("no timing records found")
+        return 1
+    downloader.timing_report(records, Console())
+    return 0
+
+
+def video_id(n):
+    return f"bench{n:06d}"
+
+
+class StandInHandler(http.server.BaseHTTPRequestHandler):
+    """The stand-in site: JSON metadata under /api, media and thumbnails."""
+
+    media = b""
+    thumbnail = b""
+
+    def do_GET(self):
+        path, _, query = self.path.partition("?")
+        if path == "/api/playlist":
+            n = int(parse_qs(query)["n"][0])
+            body = json.dumps(
+                {
+                    "title": f"Bench playlist {n}",
+                    "entries": [
+                        {"id": video_id(i), "title": f"Track {i} {video_id(i)}"}
+                        for i in range(1, n + 1)
+                    ],
+                }
+            ).encode()
+            ctype = "application/json"
+        elif path.startswith("/api/video/"):
+            vid = path.rsplit("/", 1)[1]
+            body = json.dumps(
+                {
+                    "id": vid,
+                    "title": f"Track {int(vid[5:])} {vid}",
+                    "uploader": "Bench Artist",
+                    "upload_date": "20240101",
+                    "description": "Synthetic benchmark track\n" * 20,
+                    "filesize": len(self.media),
+                    "webpage_url": f"http://{self.headers['Host']}/watch?v={vid}",
+                }
+            ).encode()
+            ctype = "application/json"
+        elif path.startswith("/media/"):
+            body, ctype = self.media, "audio/mpeg"
+        elif path.startswith("/thumb/"):
+            body, ctype = self.thumbnail, "image/png"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def stand_in_extractor():
+    """yt-dlp extractor for the stand-in site (imported lazily, like
+    downloader.py does)."""
+    from yt_dlp.extractor.common import InfoExtractor
+
+    class StandInIE(InfoExtractor):
+        IE_NAME = "standin"
+        _VALID_URL = (
+            r"https?://127\.0\.0\.1:\d+/"
+            r"(?:watch\?v=(?P<id>[\w-]+)|playlist\?(?P<query>.+))"
+        )
+
+        def _real_extract(self, url):
+            base = "/".join(url.split("/")[:3])
+            mobj = self._match_valid_url(url)
+            if mobj.group("query"):
+                data = self._download_json(
+                    f"{base}/api/playlist?{mobj.group('query')}", "playlist"
+                )
+                entries = [
+                    self.url_result(
+                        f"{base}/watch?v={e['id']}", StandInIE, e["id"], e["title"]
+                    )
+                    for e in data["entries"]
+                ]
+                return self.playlist_result(entries, "playlist", data["title"])
+            vid = mobj.group("id")
+            data = self._download_json(f"{base}/api/video/{vid}", vid)
+            return dict(
+                data,
+                formats=[
+                    {
+                        "format_id": "mp3",
+                        "url": f"{base}/media/{vid}.mp3",
+                        "ext": "mp3",
+                        "acodec": "mp3",
+                        "vcodec": "none",
+                        "filesize": data.pop("filesize"),
+                    }
+                ],
+                thumbnails=[{"url": f"{base}/thumb/{vid}.png"}],
+            )
+
+    return StandInIE
+
+
+@contextlib.contextmanager
+def stand_in_server(media_kb):
+    from PIL import Image
+
+    png = io.BytesIO()
+    Image.new("RGB", (480, 360), (200, 40, 40)).save(png, "PNG")
+    handler = type(
+        "Handler",
+        (StandInHandler,),
+        {
+            "media": MP3_FRAME * (media_kb * 1024 // len(MP3_FRAME)),
+            "thumbnail": png.getvalue(),
+        },
+    )
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        yield f"http://127.0.0.1:{server.server_address[1]}"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def timed_rate(fn, items, nbytes=None, repeat=1):
+    """Run fn() repeat times and return the best throughput as a metrics dict."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    elapsed = min(times)
+    metrics = {"seconds": round(elapsed, 4), "items_per_s": round(items / elapsed, 2)}
+    if nbytes is not None:
+        metrics["mb_per_s"] = round(nbytes / elapsed / 1024 / 1024, 2)
+    return metrics
+
+
+def bench_size(downloader, session, base, n, work, jobs, media_bytes, repeat):
+    """Run every benchmark for a batch of n items; return {name: metrics}.
+
+    Downloads run once per size; the cheaper steps report the best of
+    `repeat` runs, which keeps the numbers steady enough to compare.
+    """
+    from rich.console import Console
+
+    results = {}
+    quiet = Console(file=io.StringIO())
+    entries = []
+
+    def playlist():
+        entries[:] = downloader.fetch_playlist_entries(
+            f"{base}/playlist?list=bench&n={n}", session
+        )
+
+    results["playlist"] = timed_rate(playlist, n, repeat=repeat)
+    urls = [f"{base}/watch?v={e['id']}" for e in entries]
+
+    folder = os.path.join(work, f"library-{n}")
+    archive = downloader.DownloadArchive(os.path.join(work, f"archive-{n}.sqlite3"))
+    downloader.THUMBNAIL_CACHE = downloader.ThumbnailCache(
+        os.path.join(work, f"thumbnails-{n}")
+    )
+    # a cold info cache, so every size extracts each video once
+    downloader.INFO_CACHE = downloader.InfoCache(
+        os.path.join(work, f"info-cache-{n}.sqlite3")
+    )
+    opts = downloader.build_opts("audio", "mp3", folder)
+    opts.update(quiet=True, noprogress=True)
+    failed = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        results["download"] = timed_rate(
+            lambda: failed.extend(
+                downloader.download_task(
+                    opts,
+                    urls,
+                    [],
+                    "audio",
+                    quiet,
+                    "mp3",
+                    jobs=jobs,
+                    session=session,
+                    archive=archive,
+                )
+            ),
+            n,
+            n * media_bytes,
+        )
+    results["download"]["failed"] = len(failed)
+
+    results["resume_check"] = timed_rate(
+        lambda: downloader.resume_check(urls, folder, "mp3", False, archive=archive),
+        n,
+        repeat=repeat,
+    )
+    results["resume_check_scan"] = timed_rate(
+        lambda: downloader.resume_check(urls, folder, "mp3", False), n, repeat=repeat
+    )
+    archive.close()
+
+    covers = []
+
+    def thumbnails():
+        # a cold cache every run, so each cover is fetched and converted
+        cache = os.path.join(work, f"thumbnails-cold-{n}")
+        shutil.rmtree(cache, ignore_errors=True)
+        downloader.THUMBNAIL_CACHE = downloader.ThumbnailCache(cache)
+        covers[:] = [
+            downloader.download_thumbnail_convert(f"{base}/thumb/{video_id(i)}.png")
+            for i in range(1, n + 1)
+        ]
+
+    results["thumbnail"] = timed_rate(thumbnails, n, repeat=repeat)
+
+    files = [
+        os.path.join(root, f)
+        for root, _, names in os.walk(folder)
+        for f in names
+        if f.endswith(".mp3")
+    ]
+    info = {"title": "Retagged", "uploader": "Bench Artist", "upload_date": "20240101"}
+    results["tag"] = timed_rate(
+        lambda: [
+            downloader.write_metadata(f, info, "mp3", i, "Bench Album", covers[0])
+            for i, f in enumerate(files, 1)
+        ],
+        len(files) or 1,
+        repeat=repeat,
+    )
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Print results next to baseline; return the list of regressions."""
+    regressions = []
+    print(f"compared with baseline from {baseline.get('date', '?')}:")
+    for name, sizes in results["benchmarks"].items():
+        for size, metrics in sizes.items():
+            old = baseline.get("benchmarks", {}).get(name, {}).get(size, {})
+            for key in ("items_per_s", "mb_per_s"):
+                if key not in metrics or not old.get(key):
+                    continue
+                change = metrics[key] / old[key] - 1
+                print(
+                    f"  {name:<18} n={size:<5} {key:<12} "
+                    f"{old[key]:>10.1f} -> {metrics[key]:>10.1f} ({change:+.0%})"
+                )
+                if change < -tolerance:
+                    regressions.append(f"{name} n={size} {key} {change:+.0%}")
+    for key in ("startup_ms", "peak_rss_mb"):
+        if baseline.get(key):
+            change = results[key] / baseline[key] - 1
+            print(
+                f"  {key:<37} {baseline[key]:>10.1f} -> {results[key]:>10.1f} "
+                f"({change:+.0%})"
+            )
+            if change > tolerance:
+                regressions.append(f"{key} {change:+.0%}")
+    return regressions
+
+
+def bench_suite(args):
+    sys.path.insert(0, HERE)
+    import downloader
+    import yt_dlp.version
+
+    sizes = [int(x) for x in args.sizes.split(",")]
+    results = {
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": sys.version.split()[0],
+        "yt_dlp": yt_dlp.version.__version__,
+        "sizes": sizes,
+        "jobs": args.jobs,
+        "repeat": args.repeat,
+        "media_kb": args.media_kb,
+        "startup_ms": round(
+            statistics.median(import_times()["downloader"] for _ in range(3)), 1
+        ),
+        "benchmarks": {},
+    }
+    # measure the code, not the politeness delays
+    downloader.RATE_LIMITER = downloader.RateLimiter(None, 0)
+    work = tempfile.mkdtemp(prefix="yt-downloader-bench-")
+    session = downloader.YDLSession(extractors=[stand_in_extractor()])
+    try:
+        with stand_in_server(args.media_kb) as base:
+            # warm up the extractor and the session's YoutubeDL first
+            downloader.fetch_playlist_entries(f"{base}/playlist?n=1", session)
+            media_bytes = args.media_kb * 1024 // len(MP3_FRAME) * len(MP3_FRAME)
+            for n in sizes:
+                for name, metrics in bench_size(
+                    downloader,
+                    session,
+                    base,
+                    n,
+                    work,
+                    args.jobs,
+                    media_bytes,
+                    args.repeat,
+                ).items():
+                    results["benchmarks"].setdefault(name, {})[str(n)] = metrics
+                    extra = (
+                        f", {metrics['mb_per_s']:.1f} MB/s"
+                        if "mb_per_s" in metrics
+                        else ""
+                    )
+                    print(
+                        f"{name:<18} n={n:<5} {metrics['items_per_s']:>10.1f} items/s"
+                        + extra
+                    )
+    finally:
+        session.close()
+        shutil.rmtree(work, ignore_errors=True)
+    results["peak_rss_mb"] = round(peak_rss_mb(), 1)
+    print(f"startup {results['startup_ms']} ms, peak RSS {results['peak_rss_mb']} MB")
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"results saved to {args.output}")
+    failed = [
+        f"{name} n={size}: {m['failed']} failed"
+        for name, sizes_ in results["benchmarks"].items()
+        for size, m in sizes_.items()
+        if m.get("failed")
+    ]
+    if args.update_baseline:
+        shutil.copyfile(args.output, args.baseline)
+        print(f"baseline updated: {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            failed += compare(results, json.load(f), args.tolerance)
+    else:
+        print(f"no baseline at {args.baseline}; save one with --update-baseline")
+    if failed:
+        print("FAIL: " + "; ".join(failed))
+        return 1
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+    startup = sub.add_parser("startup", help="Check import time against a budget")
+    startup.add_argument("--budget-ms", type=float, default=STARTUP_BUDGET_MS)
+    startup.add_argument("--runs", type=int, default=5)
+    startup.set_defaults(func=bench_startup)
+    timings = sub.add_parser("timings", help="Report on --timings JSONL files")
+    timings.add_argument("files", nargs="+")
+    timings.set_defaults(func=bench_timings)
+    suite = sub.add_parser("suite", help="Offline throughput benchmarks")
+    suite.add_argument("--sizes", default="10,50,200", help="Batch sizes to run")
+    suite.add_argument("--jobs", type=int, default=4, help="Parallel downloads")
+    suite.add_argument("--media-kb", type=int, default=256, help="Size of each item")
+    suite.add_argument(
+        "--repeat", type=int, default=5, help="Runs of each cheap step (best counts)"
+    )
+    suite.add_argument(
+        "--output", default=os.path.join(RESULTS_DIR, "last.json"), help="Results file"
+    )
+    suite.add_argument(
+        "--baseline",
+        default=os.path.join(RESULTS_DIR, "baseline.json"),
+        help="Results to compare with",
+    )
+    suite.add_argument(
+        "--update-baseline",
+        action="store_true",
+        help="Save this run as the baseline instead of comparing",
+    )
+    suite.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.25,
+        help="Allowed slowdown before a benchmark counts as a regression",
+    )
+    suite.set_defaults(func=bench_suite)
+    args = parser.parse_args()
+    sys.exit(args.func(args))
+
+
+if __name__ == "__main__":
+    main()
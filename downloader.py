@@ -2,39 +2,69 @@ import os
 import re
 import sys
 import threading
+import functools
+import contextlib
+import queue
 import subprocess
 import shutil
-import requests
-import pyperclip
 import json
-import tempfile
+import sqlite3
+import time
+import hashlib
+import math
+import heapq
+import itertools
+import io
+import zlib
 import argparse
-import glob
-from PIL import Image
-from mutagen.easyid3 import EasyID3
-from mutagen.id3 import ID3, APIC
-from mutagen.flac import FLAC, Picture
-from rich.console import Console
-from rich.progress import (
-    Progress,
-    BarColumn,
-    TextColumn,
-    TimeElapsedColumn,
-    TimeRemainingColumn,
-)
-from rich.prompt import Prompt, Confirm
-from rich.table import Table
+
+# Heavy third-party modules (rich, requests, PIL, mutagen, pyperclip, yt_dlp)
+# are imported inside the functions that use them to keep startup fast; see
+# `python benchmark.py startup`.
 
 CONFIG_FILE = "yt_downloader_config.json"
+ARCHIVE_FILE = "yt_downloader_archive.sqlite3"
 COOKIES_FILE = os.path.join(os.path.dirname(__file__), "cookies.txt")
 COOKIEFILE = COOKIES_FILE if os.path.exists(COOKIES_FILE) else None
 PROXY = None
+PROXY_POOL = None
+THUMBNAIL_CACHE_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), ".cache", "thumbnails"
+)
+THUMBNAIL_CACHE = None
+# extracted info_dicts carry signed media URLs that YouTube expires after a
+# few hours, so cached ones are only trusted for this long (seconds)
+INFO_CACHE_TTL = 3600
+INFO_CACHE = None
+STAGING_DIR = None
+STAGING = None
+DISK_BUDGET = None
+USE_ARIA2C = True
+RATE_LIMITER = None
+HTTP_SESSION = None
+HTTP_SESSION_LOCK = threading.Lock()
 
 
 class GracefulExit(Exception):
     pass
 
 
+def config_proxies(config):
+    """The configured proxy pool: 'proxies', else the single 'proxy'."""
+    if config.get("proxies"):
+        return list(config["proxies"])
+    return [config["proxy"]] if config.get("proxy") else []
+
+
+def save_proxy(config, proxy):
+    """Save proxy as the only configured proxy, replacing any pool (which
+    config_proxies would otherwise prefer). Returns the size of that pool."""
+    replaced = len(config.pop("proxies", None) or [])
+    config["proxy"] = proxy
+    save_config(config)
+    return replaced
+
+
 def load_config():
     if os.path.exists(CONFIG_FILE):
         try:
@@ -60,6 +90,8 @@ def ensure_dirs():
 
 def get_clipboard_url():
     try:
+        import pyperclip
+
         text = pyperclip.paste().strip()
         if re.search(
             r"(https?://)?(www\.)?(youtube\.com|youtu\.be|music\.youtube\.com)/", text
@@ -70,15 +102,77 @@ def get_clipboard_url():
     return None
 
 
-def check_yt_dlp_update(console):
+def installed_yt_dlp_version():
+    """Return the installed yt-dlp version without spawning a subprocess."""
     try:
-        res = requests.get("https://pypi.org/pypi/yt-dlp/json", timeout=5)
-        latest = res.json()["info"]["version"]
+        from importlib.metadata import version
+
+        return version("yt-dlp")
+    except Exception:
         out = subprocess.run(["yt-dlp", "--version"], capture_output=True, text=True)
-        current = out.stdout.strip()
-        if current != latest:
+        return out.stdout.strip()
+
+
+class UpdateChecker:
+    """Looks up the latest yt-dlp release on PyPI in a background thread.
+
+    A result cached in the config under 'update_check' is reused without
+    touching the network until it is older than ttl_hours; a fresh result is
+    saved there as soon as it arrives."""
+
+    def __init__(self, config, ttl_hours=24):
+        self.cached = config.get("update_check") or {}
+        self.ttl = float(ttl_hours) * 3600
+        self.latest = None
+        self.result = None
+        self.asked = False
+
+    def start(self):
+        if time.time() - self.cached.get("checked_at", 0) < self.ttl:
+            self.latest = self.cached.get("latest")
+            return
+        import atexit
+
+        # saved again at exit, in case a config saved by the main thread in
+        # the meantime dropped it
+        atexit.register(self._save)
+        threading.Thread(target=self._fetch, daemon=True).start()
+
+    def _save(self):
+        if self.result:
+            config = load_config()
+            config["update_check"] = self.result
+            save_config(config)
+
+    def _fetch(self):
+        try:
+            res = http_session().get("https://pypi.org/pypi/yt-dlp/json", timeout=5)
+            latest = res.json()["info"]["version"]
+        except Exception:
+            return
+        self.result = {"checked_at": time.time(), "latest": latest}
+        self.latest = latest
+        self._save()
+
+
+def check_yt_dlp_update(console, checker):
+    """Offer a yt-dlp update if the background check has found one.
+
+    Never waits for the network: if the check has not finished yet, this
+    does nothing and the next call (before and after each batch) tries
+    again."""
+    if checker is None:
+        return
+    if checker.asked or not checker.latest:
+        return
+    try:
+        from rich.prompt import Prompt
+
+        current = installed_yt_dlp_version()
+        if current != checker.latest:
+            checker.asked = True
             ans = Prompt.ask(
-                f"Update available for yt-dlp: {latest}. Update? [Y/n]",
+                f"Update available for yt-dlp: {checker.latest}. Update? [Y/n]",
                 choices=["Y", "n"],
                 default="Y",
             )
@@ -87,6 +181,8 @@ def check_yt_dlp_update(console):
                 subprocess.run([sys.executable, "-m", "pip", "install", "-U", "yt-dlp"])
                 console.print("yt-dlp updated. Please restart the program.")
                 raise GracefulExit
+    except GracefulExit:
+        raise
     except:
         pass
 
@@ -104,12 +200,60 @@ def guess_is_music(url):
 
 
 def is_playlist(url):
+    kind = canonical_url(url)[0]
+    if kind:
+        return kind != "video"
     return (
         "list=" in url or "/playlist?" in url or "/playlist/" in url
     ) and "watch?" not in url
 
 
-def parse_selection(selection, total):
+YOUTUBE_HOSTS = ("youtube.com", "youtu.be", "youtube-nocookie.com")
+
+
+def canonical_url(url):
+    """Return (kind, id, url) with url in its canonical form.
+
+    Every spelling of a YouTube video (youtu.be/X, watch?v=X&t=30,
+    music.youtube.com, /shorts/X, /embed/X, /live/X) becomes
+    https://www.youtube.com/watch?v=X with kind "video", and playlist links
+    become https://www.youtube.com/playlist?list=ID with kind "playlist". A
+    watch URL that also names a list is the video, as in is_playlist.
+    Channel pages (/@handle, /channel/ID, /c/name, /user/name and their
+    tabs) have kind "channel" and are keyed by their path; a bare
+    www.youtube.com channel link lists its /videos tab. Other URLs are
+    returned stripped, with kind and id None."""
+    from urllib.parse import urlsplit, parse_qs
+
+    url = url.strip()
+    parts = urlsplit(url if "://" in url else "https://" + url)
+    host = (parts.hostname or "").lower()
+    if not any(host == h or host.endswith("." + h) for h in YOUTUBE_HOSTS):
+        return None, None, url
+    query = parse_qs(parts.query)
+    vid = (query.get("v") or [""])[0]
+    m = re.match(r"/(?:shorts|embed|live|v)/([\w-]{11})(?:[/?]|$)", parts.path)
+    if host == "youtu.be":
+        vid = parts.path.strip("/").split("/")[0]
+    elif m:
+        vid = m.group(1)
+    if re.fullmatch(r"[\w-]{11}", vid):
+        return "video", vid, f"https://www.youtube.com/watch?v={vid}"
+    lid = (query.get("list") or [""])[0]
+    if lid:
+        return "playlist", lid, f"https://www.youtube.com/playlist?list={lid}"
+    path = parts.path.rstrip("/")
+    m = re.fullmatch(r"/(?:@[^/]+|channel/[^/]+|c/[^/]+|user/[^/]+)(/\w+)?", path)
+    if not m:
+        return None, None, url
+    host = "music.youtube.com" if host == "music.youtube.com" else "www.youtube.com"
+    if not m.group(1) and host == "www.youtube.com":
+        path += "/videos"
+    return "channel", path, f"https://{host}{path}"
+
+
+def parse_selection(selection, total=None):
+    """Parse '1,2,5-7' into sorted indices, clamped to total when it is known."""
     indices = set()
     for part in selection.split(","):
         part = part.strip()
@@ -121,274 +265,3239 @@ def parse_selection(selection, total):
                 continue
         elif part.isdigit():
             indices.add(int(part))
-    return sorted(i for i in indices if 1 <= i <= total)
+    return sorted(i for i in indices if 1 <= i and (total is None or i <= total))
+
+
+REQUESTS_PER_SECOND = 4.0
+MIN_REQUESTS_PER_SECOND = 0.05
+
+
+def parse_rate(text):
+    """Parse a byte rate such as '500K', '2M' or '1.5MiB/s' into bytes/s."""
+    m = re.fullmatch(
+        r"\s*(\d+(?:\.\d+)?)\s*([kmg]?)(?:i?b)?(?:/s)?\s*", str(text), re.I
+    )
+    if not m:
+        raise ValueError(f"invalid rate: {text!r}")
+    return int(float(m.group(1)) * 1024 ** " kmg".index(m.group(2).lower() or " "))
+
+
+def rate_host(url):
+    """Host that url's requests count against; YouTube's front ends are one."""
+    from urllib.parse import urlsplit
+
+    host = (urlsplit(url).hostname or "").lower()
+    for prefix in ("www.", "m.", "music."):
+        if host.startswith(prefix):
+            host = host[len(prefix) :]
+    return "youtube.com" if host == "youtu.be" else host
+
+
+class RateLimiter:
+    """Process-wide pacing for every request and byte the downloader moves.
+
+    Requests are spaced per host to at most the host's current rate, which
+    starts at max_rate requests/s and adapts AIMD-style: every successful
+    request adds a twentieth of max_rate back, a 5xx cuts it by a quarter and
+    a 429 (or bot check) halves it. Downloaded bytes are metered against a
+    single bandwidth ceiling (bytes/s) shared by all workers. Either limit is
+    off when it is None or 0."""
+
+    def __init__(self, bandwidth=None, max_rate=REQUESTS_PER_SECOND):
+        self.bandwidth = bandwidth or None
+        self.max_rate = max_rate or None
+        self._lock = threading.Lock()
+        self._hosts = {}
+        self._bytes_due = 0.0
+        self._seen = {}
+
+    def wait(self, url):
+        """Block until a request to url's host may be sent."""
+        if not self.max_rate:
+            return
+        host = rate_host(url)
+        with self._lock:
+            state = self._hosts.setdefault(host, [self.max_rate, 0.0])
+            now = time.monotonic()
+            at = max(now, state[1])
+            state[1] = at + 1.0 / state[0]
+        if at > now:
+            time.sleep(at - now)
+
+    def report(self, url, kind=None):
+        """Adapt url's host rate to the outcome of a request: None for
+        success, else a classify_error kind."""
+        if not self.max_rate:
+            return
+        with self._lock:
+            state = self._hosts.setdefault(rate_host(url), [self.max_rate, 0.0])
+            if kind is None:
+                state[0] = min(self.max_rate, state[0] + self.max_rate / 20)
+            elif kind == "rate_limit":
+                state[0] = max(MIN_REQUESTS_PER_SECOND, state[0] / 2)
+            elif kind == "transient":
+                state[0] = max(MIN_REQUESTS_PER_SECOND, state[0] * 0.75)
+
+    def report_status(self, url, status):
+        if status == 429:
+            self.report(url, "rate_limit")
+        elif status and status >= 500:
+            self.report(url, "transient")
+        elif status:
+            self.report(url)
+
+    def rate(self, url):
+        with self._lock:
+            return self._hosts.get(rate_host(url), [self.max_rate])[0]
+
+    def consume(self, nbytes):
+        """Account for nbytes just received, sleeping to hold the bandwidth
+        ceiling. At most one second of unused allowance is carried over."""
+        if not self.bandwidth or nbytes <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._bytes_due = max(self._bytes_due, now - 1.0) + nbytes / self.bandwidth
+            delay = self._bytes_due - now
+        if delay > 0:
+            time.sleep(delay)
+
+    def progress_hook(self, d):
+        """yt-dlp progress hook feeding consume() with each download's
+        newly received bytes."""
+        key = d.get("filename")
+        with self._lock:
+            previous = self._seen.pop(key, 0)
+            if d.get("status") != "downloading":
+                return
+            received = self._seen[key] = d.get("downloaded_bytes") or 0
+        self.consume(received - previous if received >= previous else received)
+
+
+def rate_limiter():
+    global RATE_LIMITER
+    with HTTP_SESSION_LOCK:
+        if RATE_LIMITER is None:
+            RATE_LIMITER = RateLimiter()
+        return RATE_LIMITER
+
+
+def paced_urlopen(urlopen, req):
+    """YoutubeDL.urlopen wrapper that goes through the rate limiter, so
+    extraction and playlist pages are paced. Media and fragment requests
+    (which yt-dlp's downloaders send with Accept-Encoding: identity) are
+    metered by the bandwidth ceiling instead, so that a video's hundreds of
+    fragments are not spaced out like page requests."""
+    limiter = rate_limiter()
+    url = req if isinstance(req, str) else getattr(req, "url", None)
+    if url is None:
+        url = req.get_full_url()
+    headers = getattr(req, "headers", None) or {}
+    if headers.get("Accept-Encoding") != "identity":
+        limiter.wait(url)
+    try:
+        response = urlopen(req)
+    except Exception as e:
+        limiter.report_status(url, getattr(getattr(e, "response", None), "status", 0))
+        raise
+    limiter.report_status(url, getattr(response, "status", 200))
+    return response
+
+
+def throttle_progress(d):
+    rate_limiter().progress_hook(d)
+
+
+class YDLSession:
+    """Pool of warm YoutubeDL instances shared across a batch.
+
+    An instance is created the first time a worker needs one for a given set
+    of options and handed back to the pool after each item, so a batch builds
+    at most one instance per concurrent worker. Instances that talk to the
+    same proxy with the same cookies file share the first instance's cookie
+    jar and request director: cookies.txt is parsed once and HTTP connections
+    are reused across items and retries. Every instance's requests and
+    downloaded bytes go through the process-wide rate_limiter().
+
+    extractors, if given, are InfoExtractor classes registered ahead of
+    yt-dlp's own, e.g. the stand-in site used by benchmark.py."""
+
+    def __init__(self, extractors=None):
+        self.extractors = list(extractors or [])
+        self._lock = threading.Lock()
+        self._idle = {}
+        self._donors = {}
+        self._instances = []
+        self._listeners = {}
+
+    @contextlib.contextmanager
+    def ydl(self, opts, on_progress=None, home=None):
+        """Borrow an instance for opts. on_progress(d), if given, receives
+        its yt-dlp progress hook calls while it is borrowed, and home, if
+        given, replaces paths["home"] (where files are written) meanwhile."""
+        key = json.dumps(opts, sort_keys=True, default=str)
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            ydl = idle.pop() if idle else None
+        if ydl is None:
+            ydl = self._create(opts)
+        else:
+            self._reset(ydl)
+        if on_progress:
+            self._listeners[id(ydl)] = on_progress
+        if home:
+            ydl.params["paths"] = dict(opts.get("paths") or {}, home=home)
+        try:
+            yield ydl
+        finally:
+            if home:
+                ydl.params["paths"] = opts.get("paths") or {}
+            self._listeners.pop(id(ydl), None)
+            with self._lock:
+                self._idle.setdefault(key, []).append(ydl)
+
+    def _progress(self, key, d):
+        listener = self._listeners.get(key)
+        if listener:
+            listener(d)
+
+    def _create(self, opts):
+        from yt_dlp import YoutubeDL
+
+        # YoutubeDL keeps the dict it is given as its params; each instance
+        # gets its own so ydl(home=...) only affects the borrowed one
+        opts = dict(opts)
+        if self.extractors:
+            ydl = YoutubeDL(opts, auto_init=False)
+            for ie in self.extractors:
+                ydl.add_info_extractor(ie())
+            ydl.add_default_info_extractors()
+        else:
+            ydl = YoutubeDL(opts)
+        ydl.urlopen = functools.partial(paced_urlopen, ydl.urlopen)
+        ydl.add_progress_hook(throttle_progress)
+        ydl.add_progress_hook(functools.partial(self._progress, id(ydl)))
+        net_key = (opts.get("proxy"), opts.get("cookiefile"))
+        with self._lock:
+            donor = self._donors.setdefault(net_key, ydl)
+            self._instances.append(ydl)
+        if donor is not ydl:
+            # yt-dlp builds the cookie jar and request director lazily as
+            # cached properties; seed them from the donor before first use.
+            for attr in ("cookiejar", "_request_director"):
+                if isinstance(
+                    getattr(type(ydl), attr, None), functools.cached_property
+                ):
+                    ydl.__dict__[attr] = getattr(donor, attr)
+        return ydl
+
+    def _reset(self, ydl):
+        """Clear the state yt-dlp keeps for the previous item."""
+        ydl._download_retcode = 0
+        if hasattr(ydl, "_playlist_level"):
+            ydl._playlist_level = 0
+            ydl._playlist_urls.clear()
+
+    def close(self):
+        with self._lock:
+            instances, self._instances = self._instances, []
+            donors = list(self._donors.values())
+            self._idle = {}
+            self._donors = {}
+        for ydl in instances:
+            if any(ydl is d for d in donors):
+                ydl.__exit__(None, None, None)
+            else:
+                # shared state is saved and closed by its donor
+                ydl.__dict__.pop("cookiejar", None)
+                ydl.__dict__.pop("_request_director", None)
 
 
-def fetch_playlist_entries(url):
-    from yt_dlp import YoutubeDL
+def iter_playlist_entries(url, session=None, stop_after=None):
+    """Yield playlist entries as yt-dlp pages through the listing.
 
-    entries = []
-    ydl_opts = {"quiet": True, "extract_flat": True, "forcejson": True}
+    The listing is extracted unprocessed, so for paged sources (channels, long
+    playlists) each page is only requested when the loop reaches it, and
+    nothing past entry number stop_after is fetched."""
+    kind, _, listing = canonical_url(url)
+    if kind in ("playlist", "channel"):
+        # a bare channel page would list its tabs instead of its videos
+        url = listing
+    ydl_opts = {"quiet": True, "extract_flat": "in_playlist"}
+    if stop_after:
+        ydl_opts["playlistend"] = stop_after
     if COOKIEFILE:
         ydl_opts["cookiefile"] = COOKIEFILE
-    if PROXY:
-        ydl_opts["proxy"] = PROXY
-    with YoutubeDL(ydl_opts) as ydl:
-        info = ydl.extract_info(url, download=False)
-        if "entries" in info:
-            for i, e in enumerate(info["entries"], 1):
+    proxy = PROXY_POOL.acquire() if PROXY_POOL else PROXY
+    if proxy:
+        ydl_opts["proxy"] = proxy
+    own_session = session is None
+    if own_session:
+        session = YDLSession()
+    ok = None
+    try:
+        with session.ydl(ydl_opts) as ydl:
+            info = ydl.extract_info(url, download=False, process=False)
+            # follow redirects such as music.youtube.com playlists -> tab pages
+            while info.get("_type") in ("url", "url_transparent"):
+                info = ydl.extract_info(
+                    info["url"],
+                    download=False,
+                    process=False,
+                    ie_key=info.get("ie_key"),
+                )
+            for i, e in enumerate(info.get("entries") or [], 1):
+                if stop_after and i > stop_after:
+                    break
                 title = e.get("title") or f"Untitled {i}"
-                entries.append({"index": i, "id": e.get("id"), "title": title})
-    return entries
+                yield {
+                    "index": i,
+                    "id": e.get("id"),
+                    "title": title,
+                    "upload_date": e.get("upload_date"),
+                }
+        ok = True
+    except GeneratorExit:
+        raise
+    except Exception as e:
+        ok = None if classify_error(e) == "permanent" else False
+        raise
+    finally:
+        if PROXY_POOL:
+            PROXY_POOL.release(proxy, ok)
+        if own_session:
+            session.close()
+
+
+def fetch_playlist_entries(url, session=None):
+    return list(iter_playlist_entries(url, session))
+
+
+def stream_playlist(
+    url, session, wanted=None, skip_existing=None, folder=None, fmt=None, archive=None
+):
+    """Yield download items for a playlist while it is still being listed.
+
+    wanted is the list of selected indices (None for all); listing stops after
+    the last one. With skip_existing set to a LibraryIndex, entries already in
+    the library or archive are dropped as they arrive. Items carry the track
+    number they would have had in a fully listed batch."""
+    wanted_set = set(wanted) if wanted else None
+    stop_after = max(wanted) if wanted else None
+    track = 0
+    for e in iter_playlist_entries(url, session, stop_after):
+        if wanted_set and e["index"] not in wanted_set:
+            continue
+        track += 1
+        if skip_existing is not None:
+            todo, _, _ = resume_check(
+                [e], os.path.abspath(folder), fmt, True, skip_existing, archive
+            )
+            if not todo:
+                continue
+        yield {
+            "url": f"https://www.youtube.com/watch?v={e['id']}",
+            "track": track,
+        }
+
+
+PROXY_SCHEMES = ("http", "https", "socks4", "socks4a", "socks5", "socks5h")
+PROXY_PROBE_URL = "https://www.youtube.com/generate_204"
+PROXY_PROBE_INTERVAL = 60
+PROXY_MAX_FAILURES = 2
+
+
+def validate_proxy(proxy: str) -> bool:
+    """Return True if proxy looks like a valid proxy URL: a scheme yt-dlp
+    supports (see PROXY_SCHEMES) and a host."""
+    try:
+        from urllib.parse import urlparse
+
+        p = urlparse(proxy)
+        return bool(p.scheme.lower() in PROXY_SCHEMES and p.hostname)
+    except Exception:
+        return False
+
+
+def probe_proxy(proxy, url=PROXY_PROBE_URL, timeout=10):
+    """Time a request to url through proxy. Returns the latency in seconds,
+    0.0 if the proxy cannot be probed from here (SOCKS without PySocks), or
+    None if it is unreachable."""
+    import requests
+
+    start = time.monotonic()
+    try:
+        requests.get(
+            url, proxies={"http": proxy, "https": proxy}, timeout=timeout
+        ).raise_for_status()
+    except requests.exceptions.InvalidSchema:
+        return 0.0
+    except Exception:
+        return None
+    return time.monotonic() - start
+
+
+class ProxyPool:
+    """Set of proxies that items are spread over.
+
+    A background thread probes every proxy each `interval` seconds. Items go
+    to the healthy proxy with the lowest latency, weighted by how many items
+    it is already carrying. A proxy that fails PROXY_MAX_FAILURES items in a
+    row is taken out of rotation until a probe succeeds again, so work fails
+    over to the others. Bytes, time and results per proxy are kept for the
+    summary."""
+
+    def __init__(self, proxies, probe_url=PROXY_PROBE_URL, interval=None):
+        self.probe_url = probe_url
+        self.interval = interval or PROXY_PROBE_INTERVAL
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._stats = {
+            p: dict(
+                healthy=True,
+                latency=None,
+                active=0,
+                failures=0,
+                ok=0,
+                failed=0,
+                bytes=0,
+                seconds=0.0,
+            )
+            for p in dict.fromkeys(proxies)
+        }
+
+    def __len__(self):
+        return len(self._stats)
+
+    def start(self):
+        threading.Thread(target=self._probe_loop, daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _probe_loop(self):
+        while not self._stop.is_set():
+            for proxy in list(self._stats):
+                latency = probe_proxy(proxy, self.probe_url)
+                with self._lock:
+                    s = self._stats[proxy]
+                    s["healthy"] = latency is not None
+                    if latency:
+                        s["latency"] = (
+                            latency
+                            if s["latency"] is None
+                            else 0.7 * s["latency"] + 0.3 * latency
+                        )
+                    if latency is not None:
+                        s["failures"] = 0
+            self._stop.wait(self.interval)
+
+    def acquire(self):
+        """Pick the proxy for the next attempt and count it as busy."""
+        with self._lock:
+            candidates = [p for p, s in self._stats.items() if s["healthy"]]
+            # nothing healthy: try whichever failed least rather than nothing
+            candidates = candidates or list(self._stats)
+            proxy = min(
+                candidates,
+                key=lambda p: (
+                    self._stats[p]["failures"],
+                    (self._stats[p]["latency"] or 1.0) * (1 + self._stats[p]["active"]),
+                ),
+            )
+            self._stats[proxy]["active"] += 1
+            return proxy
+
+    def release(self, proxy, ok, nbytes=0, seconds=0.0):
+        """Record the outcome of an attempt made through proxy. ok=None means
+        the failure was not the proxy's fault."""
+        with self._lock:
+            s = self._stats[proxy]
+            s["active"] -= 1
+            if ok:
+                s["ok"] += 1
+                s["failures"] = 0
+                s["bytes"] += nbytes or 0
+                s["seconds"] += seconds
+            elif ok is False:
+                s["failed"] += 1
+                s["failures"] += 1
+                if s["failures"] >= PROXY_MAX_FAILURES:
+                    s["healthy"] = False
+
+    def stats(self):
+        """Per-proxy stats as a list of dicts (for JSON output)."""
+        with self._lock:
+            return [
+                dict(
+                    proxy=p,
+                    healthy=s["healthy"],
+                    latency_ms=round(s["latency"] * 1000) if s["latency"] else None,
+                    ok=s["ok"],
+                    failed=s["failed"],
+                    bytes=s["bytes"],
+                    bytes_per_second=(
+                        round(s["bytes"] / s["seconds"]) if s["seconds"] else None
+                    ),
+                )
+                for p, s in self._stats.items()
+            ]
+
+
+def proxy_pool_table(pool):
+    from rich.table import Table
+
+    table = Table(title="Proxies")
+    table.add_column("Proxy")
+    table.add_column("Health", justify="center")
+    table.add_column("Latency", justify="right")
+    table.add_column("OK", justify="right")
+    table.add_column("Failed", justify="right")
+    table.add_column("Downloaded", justify="right")
+    table.add_column("Throughput", justify="right")
+    for s in pool.stats():
+        table.add_row(
+            s["proxy"],
+            "up" if s["healthy"] else "down",
+            f"{s['latency_ms']} ms" if s["latency_ms"] is not None else "",
+            str(s["ok"]),
+            str(s["failed"]),
+            natural_size(s["bytes"]),
+            (
+                natural_size(s["bytes_per_second"]) + "/s"
+                if s["bytes_per_second"]
+                else ""
+            ),
+        )
+    return table
+
+
+def sanitize(s):
+    return re.sub(r'[\/\\\:\*\?"<>\|]', "_", s)
+
+
+VIDEO_ID_RE = re.compile(r"(?<![\w-])([\w-]{11})(?![\w-])")
+
+
+def video_id_from_url(url):
+    m = re.search(r"(?:v=|youtu\.be/|/shorts/)([\w-]{11})", url or "")
+    return m.group(1) if m else None
+
+
+class LibraryIndex:
+    """Filename and video-ID index of everything under an output folder.
+
+    The tree is walked once and every lookup is a dict hit. With persist=True
+    the listing is saved as JSON in the folder together with each directory's
+    mtime, and the next refresh() only re-lists directories whose mtime has
+    changed, so repeated runs against a large library start almost at once."""
+
+    INDEX_FILE = ".yt_downloader_index.json"
+
+    def __init__(self, root, persist=False):
+        self.root = os.path.abspath(root)
+        self.persist = persist
+        self.by_name = {}
+        self.by_id = {}
+        self._dirs = {}
+        if persist:
+            self._load()
+        self.refresh()
+
+    def _index_path(self):
+        return os.path.join(self.root, self.INDEX_FILE)
+
+    def _load(self):
+        try:
+            with open(self._index_path()) as f:
+                data = json.load(f)
+            if data.get("version") == 1:
+                self._dirs = data.get("dirs", {})
+        except:
+            self._dirs = {}
+
+    def save(self):
+        if not self.persist:
+            return
+        tmp = self._index_path() + ".tmp"
+        try:
+            with open(tmp, "w") as f:
+                json.dump({"version": 1, "dirs": self._dirs}, f)
+            os.replace(tmp, self._index_path())
+        except:
+            pass
+
+    def refresh(self):
+        """Bring the index up to date, re-listing only changed directories."""
+        dirs = {}
+        stack = [""]
+        while stack:
+            rel = stack.pop()
+            path = os.path.join(self.root, rel) if rel else self.root
+            try:
+                mtime = os.stat(path).st_mtime
+            except OSError:
+                continue
+            listing = self._dirs.get(rel)
+            if listing is None or listing["mtime"] != mtime:
+                files, subdirs = [], []
+                try:
+                    with os.scandir(path) as it:
+                        for entry in it:
+                            if entry.is_dir(follow_symlinks=False):
+                                subdirs.append(entry.name)
+                            elif entry.is_file():
+                                files.append(entry.name)
+                except OSError:
+                    continue
+                listing = {"mtime": mtime, "files": files, "dirs": subdirs}
+            dirs[rel] = listing
+            stack.extend(os.path.join(rel, d) for d in listing["dirs"])
+        self._dirs = dirs
+        self.by_name = {}
+        self.by_id = {}
+        for rel, listing in dirs.items():
+            for name in listing["files"]:
+                if name == self.INDEX_FILE:
+                    continue
+                path = os.path.join(self.root, rel, name)
+                self.by_name.setdefault(name, path)
+                for vid in VIDEO_ID_RE.findall(os.path.splitext(name)[0]):
+                    self.by_id.setdefault(vid, []).append(path)
+        self.save()
+
+    def find(self, name):
+        return self.by_name.get(name)
+
+    def find_id(self, vid, ext=None):
+        for path in self.by_id.get(vid, []):
+            if ext is None or path.endswith("." + ext):
+                return path
+        return None
+
+
+class DownloadArchive:
+    """SQLite record of finished downloads, keyed by video ID and format.
+
+    Safe to share between download workers."""
+
+    def __init__(self, path=ARCHIVE_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._db:
+            self._db.execute("""CREATE TABLE IF NOT EXISTS downloads (
+                    video_id TEXT NOT NULL,
+                    format TEXT NOT NULL,
+                    path TEXT NOT NULL,
+                    size INTEGER,
+                    completed_at REAL NOT NULL,
+                    PRIMARY KEY (video_id, format)
+                )""")
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS downloads_path ON downloads (path)"
+            )
+            self._db.execute("""CREATE TABLE IF NOT EXISTS sync_state (
+                    url TEXT PRIMARY KEY,
+                    state TEXT NOT NULL,
+                    synced_at REAL NOT NULL
+                )""")
+
+    def record(self, video_id, fmt, path, size=None, completed_at=None):
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO downloads VALUES (?, ?, ?, ?, ?)",
+                (
+                    video_id,
+                    fmt,
+                    os.path.abspath(path),
+                    size,
+                    completed_at or time.time(),
+                ),
+            )
+
+    def lookup(self, video_ids, fmt):
+        """Return {video_id: path} for IDs archived in fmt whose file still exists."""
+        video_ids = [v for v in video_ids if v]
+        found = {}
+        with self._lock:
+            for i in range(0, len(video_ids), 500):
+                chunk = video_ids[i : i + 500]
+                rows = self._db.execute(
+                    "SELECT video_id, path FROM downloads WHERE format = ? "
+                    f"AND video_id IN ({','.join('?' * len(chunk))})",
+                    [fmt] + chunk,
+                ).fetchall()
+                found.update(rows)
+        return {vid: path for vid, path in found.items() if os.path.exists(path)}
+
+    def get_sync_state(self, url):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT state FROM sync_state WHERE url = ?", (url,)
+            ).fetchone()
+        return json.loads(row[0]) if row else {}
+
+    def set_sync_state(self, url, state):
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO sync_state VALUES (?, ?, ?)",
+                (url, json.dumps(state), time.time()),
+            )
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class InfoCache:
+    """SQLite cache of extracted info_dicts, keyed by video ID.
+
+    Entries older than ttl seconds count as missing and are pruned on open
+    and then every prune_interval seconds as new ones are written, so a
+    long-running daemon does not grow the table forever. The info is stored as zlib-compressed JSON in the archive database by
+    default. Safe to share between download workers."""
+
+    prune_interval = 600
+
+    def __init__(self, path=ARCHIVE_FILE, ttl=INFO_CACHE_TTL):
+        self.ttl = ttl
+        self._pruned = time.monotonic()
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._db:
+            self._db.execute("""CREATE TABLE IF NOT EXISTS info_cache (
+                    video_id TEXT PRIMARY KEY,
+                    info BLOB NOT NULL,
+                    fetched_at REAL NOT NULL
+                )""")
+            self._prune()
+
+    def get_many(self, video_ids):
+        """Return {video_id: info} for the fresh entries among video_ids."""
+        video_ids = [v for v in video_ids if v]
+        found = {}
+        with self._lock:
+            for i in range(0, len(video_ids), 500):
+                chunk = video_ids[i : i + 500]
+                found.update(
+                    self._db.execute(
+                        "SELECT video_id, info FROM info_cache WHERE fetched_at >= ? "
+                        f"AND video_id IN ({','.join('?' * len(chunk))})",
+                        [time.time() - self.ttl] + chunk,
+                    ).fetchall()
+                )
+        return {vid: json.loads(zlib.decompress(blob)) for vid, blob in found.items()}
+
+    def get(self, video_id):
+        return self.get_many([video_id]).get(video_id)
+
+    def _prune(self):
+        self._pruned = time.monotonic()
+        self._db.execute(
+            "DELETE FROM info_cache WHERE fetched_at < ?", (time.time() - self.ttl,)
+        )
+
+    def put(self, video_id, info):
+        blob = zlib.compress(json.dumps(info).encode("utf-8"))
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO info_cache VALUES (?, ?, ?)",
+                (video_id, blob, time.time()),
+            )
+            if time.monotonic() - self._pruned >= self.prune_interval:
+                self._prune()
+
+    def discard(self, video_id):
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM info_cache WHERE video_id = ?", (video_id,))
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def info_cache():
+    """The process-wide InfoCache, or None when INFO_CACHE_TTL is 0."""
+    global INFO_CACHE
+    with HTTP_SESSION_LOCK:
+        if INFO_CACHE is None and INFO_CACHE_TTL > 0:
+            INFO_CACHE = InfoCache(ttl=INFO_CACHE_TTL)
+        return INFO_CACHE
+
+
+def item_label(url, info=None):
+    """url with its video's title in front when info or the info cache has
+    one, for summaries and failure lists."""
+    title = (info or {}).get("title")
+    vid = video_id_from_url(url)
+    if not title and vid and info_cache():
+        title = (info_cache().get(vid) or {}).get("title")
+    return f"{title} ({url})" if title else url
+
+
+def import_archive(folder, archive, console):
+    """Backfill the archive from an existing library by reading file tags.
+
+    The video ID is taken from a YouTube URL in the tags (written as the
+    'website' tag by write_metadata, or 'purl'/'comment' by yt-dlp), falling back
+    to an 11-character ID token in the filename."""
+    import mutagen
+
+    added = 0
+    unknown = 0
+    for dirpath, _, files in os.walk(folder):
+        for name in files:
+            stem, ext = os.path.splitext(name)
+            fmt = ext[1:].lower()
+            if fmt not in ("mp3", "flac", "m4a", "mp4"):
+                continue
+            path = os.path.join(dirpath, name)
+            vid = None
+            try:
+                audio = mutagen.File(path)
+                if audio is not None and audio.tags is not None:
+                    vid = video_id_from_url(audio.tags.pprint())
+            except Exception:
+                pass
+            if not vid:
+                ids = VIDEO_ID_RE.findall(stem)
+                vid = ids[-1] if ids else None
+            if not vid:
+                unknown += 1
+                continue
+            st = os.stat(path)
+            archive.record(vid, fmt, path, st.st_size, st.st_mtime)
+            added += 1
+    console.print(
+        f"Imported [green]{added}[/green] files into {archive.path}"
+        + (f", {unknown} without a video ID were skipped." if unknown else ".")
+    )
+    return added
+
+
+def resume_check(
+    entries_list,
+    out_folder,
+    fmt,
+    playlist_mode_flag,
+    index=None,
+    archive=None,
+    formats=None,
+):
+    """Return (to_download_urls, skipped_paths, summary_by_dir).
+    entries_list: list of dicts (playlist) or list of urls.
+    Video IDs found in the download archive are skipped first. The rest are
+    matched by their expected filename ('01 - Title.mp3') anywhere under
+    out_folder for playlists, or by a video ID in the filename for URLs.
+    Filename lookups go through a LibraryIndex, built here if index is None.
+    URLs whose video ID is not in any filename are matched by title
+    ('Title.mp3', as yt-dlp names single downloads) when the info cache has
+    their info, so no network request is needed.
+    Planned items (see plan_batch) can stand in for URLs; they are looked up
+    in formats[item["mode"]] when formats is given and returned as items."""
+    playlist = (
+        playlist_mode_flag
+        and isinstance(entries_list, list)
+        and entries_list
+        and isinstance(entries_list[0], dict)
+    )
+    if playlist:
+        ids = [e.get("id") for e in entries_list]
+    else:
+        urls = [e["url"] if isinstance(e, dict) else e for e in entries_list]
+        ids = [video_id_from_url(u) for u in urls]
+    item_formats = [
+        formats[e["mode"]] if formats and isinstance(e, dict) else fmt
+        for e in entries_list
+    ]
+    archived = {}
+    if archive:
+        for f in set(item_formats):
+            archived[f] = archive.lookup(
+                [vid for vid, ef in zip(ids, item_formats) if ef == f], f
+            )
+    if index is None and sum(map(len, archived.values())) < len(entries_list):
+        index = LibraryIndex(out_folder)
+    skipped = []
+    to_download = []
+    for_dir_counts = {}
+    if playlist:
+        for e in entries_list:
+            title = sanitize(e.get("title") or "")
+            idx = e.get("index")
+            fname = f"{idx:02d} - {title}.{fmt}"
+            match = archived.get(fmt, {}).get(e.get("id")) or index.find(fname)
+            if match:
+                skipped.append(match)
+                d = os.path.dirname(match)
+                for_dir_counts[d] = for_dir_counts.get(d, 0) + 1
+            else:
+                to_download.append(f"https://www.youtube.com/watch?v={e.get('id')}")
+    else:
+        cache = info_cache()
+        infos = (
+            cache.get_many(
+                [
+                    vid
+                    for vid, f in zip(ids, item_formats)
+                    if vid not in archived.get(f, {})
+                ]
+            )
+            if cache
+            else {}
+        )
+        if infos:
+            from yt_dlp.utils import sanitize_filename
+        for e, vid, f in zip(entries_list, ids, item_formats):
+            match = archived.get(f, {}).get(vid) or (
+                index.find_id(vid, f) if vid else None
+            )
+            if not match and infos.get(vid, {}).get("title"):
+                match = index.find(f"{sanitize_filename(infos[vid]['title'])}.{f}")
+            if match:
+                skipped.append(match)
+                d = os.path.dirname(match)
+                for_dir_counts[d] = for_dir_counts.get(d, 0) + 1
+            else:
+                to_download.append(e)
+    return to_download, skipped, for_dir_counts
+
+
+def http_session():
+    """Return the process-wide requests.Session (keep-alive, pooled)."""
+    global HTTP_SESSION
+    import requests
+
+    with HTTP_SESSION_LOCK:
+        if HTTP_SESSION is None:
+            HTTP_SESSION = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_maxsize=16)
+            HTTP_SESSION.mount("https://", adapter)
+            HTTP_SESSION.mount("http://", adapter)
+        return HTTP_SESSION
+
+
+def to_jpeg(data):
+    """Return image bytes as JPEG, converting in memory when needed."""
+    if data[:3] == b"\xff\xd8\xff":
+        return data
+    from PIL import Image
+
+    im = Image.open(io.BytesIO(data)).convert("RGB")
+    out = io.BytesIO()
+    im.save(out, "JPEG")
+    return out.getvalue()
+
+
+class ThumbnailCache:
+    """Content-addressed on-disk cache of cover images, stored as JPEG.
+
+    Each distinct image is kept once as objects/<sha1>.jpg and URLs point to
+    it through small files in urls/, so a cover shared by a whole album is
+    fetched and converted once. Hits refresh the file's mtime and the least
+    recently used images are evicted once the cache exceeds max_bytes.
+    Concurrent requests for the same URL wait for a single fetch."""
+
+    def __init__(self, root=THUMBNAIL_CACHE_DIR, max_bytes=100 * 1024 * 1024):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._objects = os.path.join(root, "objects")
+        self._urls = os.path.join(root, "urls")
+        os.makedirs(self._objects, exist_ok=True)
+        os.makedirs(self._urls, exist_ok=True)
+        self._lock = threading.Lock()
+        self._inflight = {}
+
+    def _lookup(self, ref):
+        try:
+            with open(ref) as f:
+                path = os.path.join(self._objects, f.read().strip() + ".jpg")
+            os.utime(path)
+            return path
+        except OSError:
+            return None
+
+    def _write(self, path, data):
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb" if isinstance(data, bytes) else "w") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def get(self, url):
+        """Return the path of the cached JPEG for url, fetching it on a miss."""
+        ref = os.path.join(self._urls, hashlib.sha1(url.encode()).hexdigest())
+        path = self._lookup(ref)
+        if path:
+            return path
+        with self._lock:
+            event = self._inflight.get(url)
+            owner = event is None
+            if owner:
+                event = self._inflight[url] = threading.Event()
+        if not owner:
+            event.wait()
+            path = self._lookup(ref)
+            if path:
+                return path
+        try:
+            limiter = rate_limiter()
+            limiter.wait(url)
+            response = http_session().get(url, timeout=8)
+            limiter.report_status(url, response.status_code)
+            response.raise_for_status()
+            data = to_jpeg(response.content)
+            digest = hashlib.sha1(data).hexdigest()
+            path = os.path.join(self._objects, digest + ".jpg")
+            if not os.path.exists(path):
+                self._write(path, data)
+            self._write(ref, digest)
+            self.evict()
+            return path
+        finally:
+            if owner:
+                with self._lock:
+                    self._inflight.pop(url, None)
+                event.set()
+
+    def evict(self):
+        """Drop least recently used images until the cache fits max_bytes.
+
+        Images used in the last minute are kept so a cover is never removed
+        between lookup and embedding."""
+        files = []
+        total = 0
+        with os.scandir(self._objects) as it:
+            for entry in it:
+                if entry.name.endswith(".jpg"):
+                    st = entry.stat()
+                    files.append((st.st_mtime, st.st_size, entry.path))
+                    total += st.st_size
+        if total <= self.max_bytes:
+            return
+        recent = time.time() - 60
+        for mtime, size, path in sorted(files):
+            if total <= self.max_bytes or mtime > recent:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+
+def thumbnail_cache():
+    global THUMBNAIL_CACHE
+    with HTTP_SESSION_LOCK:
+        if THUMBNAIL_CACHE is None:
+            THUMBNAIL_CACHE = ThumbnailCache()
+        return THUMBNAIL_CACHE
+
+
+def download_thumbnail_convert(thumbnail_url):
+    """Return a local JPEG for thumbnail_url, served from the thumbnail cache.
+
+    The returned file belongs to the cache and must not be deleted."""
+    if os.path.exists(thumbnail_url):
+        return thumbnail_url
+    return thumbnail_cache().get(thumbnail_url)
+
+
+METADATA_PADDING = 16 * 1024
+ID3_FRAMES = {
+    "title": "TIT2",
+    "artist": "TPE1",
+    "album": "TALB",
+    "date": "TDRC",
+    "genre": "TCON",
+    "tracknumber": "TRCK",
+}
+MP4_ATOMS = {
+    "title": "\xa9nam",
+    "artist": "\xa9ART",
+    "album": "\xa9alb",
+    "date": "\xa9day",
+    "genre": "\xa9gen",
+}
+
+
+def keep_padding(info):
+    """mutagen padding policy: rewrite tags in place while they fit, and
+    reserve METADATA_PADDING spare bytes when the file has to grow, so later
+    re-tags do not rewrite the audio."""
+    return info.padding if info.padding >= 0 else METADATA_PADDING
+
+
+def write_metadata(path, info, fmt, idx=None, album=None, img_file=None):
+    """Write tags and cover art to an audio file with a single parse and save."""
+    from mutagen import id3
+    from mutagen.flac import FLAC, Picture
+    from mutagen.mp4 import MP4, MP4Cover, MP4FreeForm
+
+    tags = {}
+    tags["title"] = info.get("title") or ""
+    tags["artist"] = info.get("uploader") or info.get("channel") or ""
+    tags["album"] = album or info.get("album") or info.get("playlist_title") or ""
+    tags["date"] = str(info.get("release_year") or (info.get("upload_date") or "")[:4])
+    tags["genre"] = info.get("genre") or ""
+    tags["website"] = info.get("webpage_url") or ""
+    if idx:
+        tags["tracknumber"] = str(idx)
+    tags = {k: v for k, v in tags.items() if v}
+    cover = None
+    if img_file:
+        with open(img_file, "rb") as imgf:
+            cover = imgf.read()
+    if fmt == "mp3":
+        try:
+            audio = id3.ID3(path)
+        except id3.ID3NoHeaderError:
+            audio = id3.ID3()
+        for k, frame in ID3_FRAMES.items():
+            if k in tags:
+                audio.setall(frame, [getattr(id3, frame)(encoding=3, text=tags[k])])
+        if "website" in tags:
+            audio.setall("WOAR", [id3.WOAR(url=tags["website"])])
+        if cover:
+            audio.setall(
+                "APIC",
+                [
+                    id3.APIC(
+                        encoding=3, mime="image/jpeg", type=3, desc="Cover", data=cover
+                    )
+                ],
+            )
+        audio.save(path, padding=keep_padding)
+    elif fmt == "flac":
+        audio = FLAC(path)
+        for k, v in tags.items():
+            audio[k] = v
+        if cover:
+            image = Picture()
+            image.data = cover
+            image.type = 3
+            image.mime = "image/jpeg"
+            audio.clear_pictures()
+            audio.add_picture(image)
+        audio.save(padding=keep_padding)
+    elif fmt == "m4a":
+        audio = MP4(path)
+        for k, atom in MP4_ATOMS.items():
+            if k in tags:
+                audio[atom] = [tags[k]]
+        if idx:
+            audio["trkn"] = [(int(idx), 0)]
+        if "website" in tags:
+            audio["----:com.apple.iTunes:WEBSITE"] = [
+                MP4FreeForm(tags["website"].encode())
+            ]
+        if cover:
+            audio["covr"] = [MP4Cover(cover, imageformat=MP4Cover.FORMAT_JPEG)]
+        audio.save(padding=keep_padding)
+
+
+def save_yt_description(path, desc):
+    if desc:
+        fn = os.path.splitext(path)[0] + ".txt"
+        with open(fn, "w", encoding="utf-8") as f:
+            f.write(desc)
+
+
+TAG_FIELDS = (
+    "id",
+    "ext",
+    "acodec",
+    "vcodec",
+    "title",
+    "uploader",
+    "channel",
+    "album",
+    "playlist_title",
+    "release_year",
+    "upload_date",
+    "genre",
+    "webpage_url",
+    "description",
+)
+AUDIO_CODECS = {"mp3": "libmp3lame", "m4a": "aac", "flac": "flac"}
+# acodec prefixes (as reported by yt-dlp) each target can hold without re-encoding
+COPYABLE_CODECS = {"mp3": ("mp3",), "m4a": ("mp4a", "aac"), "flac": ("flac",)}
+
+
+def thumbnail_url(info):
+    tn_url = info.get("thumbnail")
+    if not tn_url:
+        t_list = info.get("thumbnails") or []
+        tn_url = t_list[-1]["url"] if t_list else None
+    return tn_url
+
+
+def fetch_cover(info, console):
+    """Download the thumbnail for info as a JPEG. Returns its path or None.
+    Problems are reported on console, never on stdout, which --batch keeps
+    for its JSON status line."""
+    tn_url = thumbnail_url(info)
+    if not tn_url:
+        console.print(f"[yellow]No thumbnail found for {info.get('title')}[/yellow]")
+        return None
+    try:
+        return download_thumbnail_convert(tn_url)
+    except Exception as e:
+        console.print(f"[yellow]Thumbnail error: {e}[/yellow]")
+        return None
+
+
+TIMING_STAGES = (
+    "extract",
+    "download",
+    "thumbnail",
+    "postprocess",
+    "tag",
+    "description",
+    "admit",
+    "publish",
+)
+
+
+@contextlib.contextmanager
+def timed(timings, stage):
+    """Add the wall time spent in the block to timings[stage]."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - start
+
+
+def finish_audio(
+    path, info, fmt, track=None, album=None, img=None, do_lyrics=True, timings=None
+):
+    """Write tags and cover in one pass and save the description for an audio file."""
+    with timed(timings, "tag"):
+        write_metadata(path, info, fmt, track, album, img)
+    if do_lyrics:
+        with timed(timings, "description"):
+            save_yt_description(path, info.get("description"))
+
+
+def plan_audio_conversion(info, fmt):
+    """Decide how to turn the downloaded stream described by info into fmt.
+
+    Returns 'copy' when the file can be used as is, 'remux' when only the
+    container differs, or 'transcode' when the audio has to be re-encoded."""
+    acodec = (info.get("acodec") or "").lower()
+    if not acodec.startswith(COPYABLE_CODECS.get(fmt, ())):
+        return "transcode"
+    if (info.get("ext") or "").lower() == fmt and (
+        info.get("vcodec") or "none"
+    ).lower() == "none":
+        return "copy"
+    return "remux"
+
+
+def transcode_audio(src, fmt, action="transcode"):
+    """Convert src to fmt with ffmpeg, replacing src. Returns the new path.
+
+    action comes from plan_audio_conversion; 'remux' stream-copies the audio
+    and 'copy' leaves the file alone."""
+    base, ext = os.path.splitext(src)
+    if action == "copy" and ext.lower() == "." + fmt:
+        return src
+    dest = base + "." + fmt
+    tmp = base + ".tmp." + fmt
+    if action == "transcode":
+        codec = ["-c:a", AUDIO_CODECS[fmt]]
+    else:
+        codec = ["-c:a", "copy"]
+        if fmt == "m4a" and ext.lower() not in (".m4a", ".mp4"):
+            codec += ["-bsf:a", "aac_adtstoasc"]
+    out = subprocess.run(
+        ["ffmpeg", "-y", "-loglevel", "error", "-i", src, "-vn"] + codec + [tmp],
+        capture_output=True,
+        text=True,
+    )
+    if out.returncode != 0:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise RuntimeError(f"ffmpeg failed: {out.stderr.strip()}")
+    os.replace(tmp, dest)
+    if src != dest:
+        os.remove(src)
+    return dest
+
+
+def postprocess_audio(
+    src,
+    fmt,
+    info,
+    track=None,
+    album=None,
+    img=None,
+    do_lyrics=True,
+    action=None,
+    stage="downloaded",
+    on_stage=None,
+    publish=None,
+):
+    """Convert, embed cover and tag a downloaded audio stream.
+
+    stage is the last journal state reached for src, so a resumed item skips
+    what is already done; on_stage(state, path) is called after each step.
+    With publish, an (item_dir, library) pair, the finished files are moved
+    from the staging area into the library (see publish_staged).
+    Runs inline or in an AudioPipeline worker process. Returns
+    (final_path, size, action, timings) where timings maps stage names to
+    seconds."""
+    timings = {}
+    action = action or plan_audio_conversion(info, fmt)
+    path = src
+    if stage == "downloaded":
+        with timed(timings, "postprocess"):
+            path = transcode_audio(src, fmt, action)
+        if on_stage:
+            on_stage("transcoded", path)
+    if stage != "tagged":
+        finish_audio(path, info, fmt, track, album, img, do_lyrics, timings)
+        if on_stage:
+            on_stage("tagged", path)
+    if publish:
+        with timed(timings, "publish"):
+            path = publish_staged(path, *publish)
+    return path, os.path.getsize(path), action, timings
+
+
+class AudioPipeline:
+    """Process pool that transcodes, embeds covers and tags audio files while
+    the download workers move on to the next item.
+
+    submit() blocks once `backlog` items are waiting for a CPU, so downloads
+    cannot run arbitrarily far ahead of transcoding."""
+
+    def __init__(self, workers=None, backlog=None):
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+
+        self.workers = workers or os.cpu_count() or 1
+        # workers start from download threads; forking while other threads
+        # hold locks (imports, Rich's refresh) can deadlock the child
+        method = "forkserver" if sys.platform != "win32" else "spawn"
+        self._pool = ProcessPoolExecutor(
+            max_workers=self.workers, mp_context=multiprocessing.get_context(method)
+        )
+        self._slots = threading.BoundedSemaphore(backlog or self.workers * 2)
+
+    def submit(self, fn, *args):
+        self._slots.acquire()
+        try:
+            future = self._pool.submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda f: self._slots.release())
+        return future
+
+    def close(self):
+        self._pool.shutdown(wait=True)
+
+
+MIN_FREE_BYTES = 256 * 1024 * 1024
+# reserved for an item whose formats do not report a size
+DEFAULT_ITEM_BYTES = {"audio": 64 * 1024 * 1024, "video": 1024 * 1024 * 1024}
+
+
+def estimate_bytes(info, mode):
+    """Expected download size of info (as extracted, unprocessed) in mode,
+    from its formats' filesize or filesize_approx, else bitrate x duration.
+    Takes the largest candidate, as the best formats are what gets picked.
+    Returns None when nothing reports a size."""
+
+    def size(f):
+        if f.get("filesize") or f.get("filesize_approx"):
+            return f.get("filesize") or f.get("filesize_approx")
+        if f.get("tbr") and info.get("duration"):
+            return int(f["tbr"] * 125 * info["duration"])
+        return None
+
+    formats = info.get("formats") or [info]
+    audio = [
+        size(f)
+        for f in formats
+        if f.get("vcodec") == "none" and f.get("acodec") not in (None, "none")
+    ]
+    audio = max([n for n in audio if n], default=None)
+    if mode == "audio" and audio:
+        return audio
+    video = [size(f) for f in formats if f.get("vcodec") not in (None, "none")]
+    video = max([n for n in video if n], default=None)
+    if video is None:
+        return audio
+    return video + (audio or 0)
+
+
+def existing_dir(path):
+    """path, or its nearest ancestor that exists (for free-space checks on
+    folders not created yet)."""
+    while not os.path.isdir(path) and os.path.dirname(path) != path:
+        path = os.path.dirname(path)
+    return path
+
+
+class DiskBudget:
+    """Disk-space admission control for the items being worked on.
+
+    reserve() admits an item once every filesystem it writes to (the output
+    folder and the staging area) has room for its estimated size on top of
+    what the items already admitted there have reserved, and min_free. An
+    estimate counts in full until the item settles, so the check errs on the
+    safe side while downloads grow. An item that does not fit even with
+    nothing else admitted fails at once with ENOSPC instead of filling the
+    disk part-way. Projected and actual sizes of settled items are totalled
+    for the summary."""
+
+    def __init__(self, min_free=MIN_FREE_BYTES):
+        self.min_free = min_free
+        self.reserved = {}
+        self.items = 0
+        self.projected = 0
+        self.actual = 0
+        self._changed = threading.Condition()
+
+    def reserve(self, nbytes, paths, estimated=True):
+        """Wait until nbytes fit on the filesystems of paths and hold them
+        there; returns the token to pass to settle()."""
+        import errno
+
+        paths = [existing_dir(path) for path in paths]
+        with self._changed:
+            while True:
+                free = {
+                    os.stat(path).st_dev: shutil.disk_usage(path).free for path in paths
+                }
+                room = min(
+                    n - self.reserved.get(dev, 0) - self.min_free
+                    for dev, n in free.items()
+                )
+                if nbytes <= room:
+                    break
+                if not any(self.reserved.get(dev) for dev in free):
+                    raise OSError(
+                        errno.ENOSPC,
+                        f"Not enough disk space: needs about {natural_size(nbytes)}, "
+                        f"{natural_size(max(room, 0))} available",
+                    )
+                # re-check now and then: other programs free space too
+                self._changed.wait(5)
+            for dev in free:
+                self.reserved[dev] = self.reserved.get(dev, 0) + nbytes
+        return list(free), nbytes, estimated
+
+    def settle(self, token, actual=None):
+        """Release a reservation; actual is the item's final size on disk,
+        or None when it failed."""
+        devices, nbytes, estimated = token
+        with self._changed:
+            for dev in devices:
+                self.reserved[dev] -= nbytes
+            if actual is not None and estimated:
+                self.items += 1
+                self.projected += nbytes
+                self.actual += actual
+            self._changed.notify_all()
+
+    def reset_usage(self):
+        with self._changed:
+            self.items = self.projected = self.actual = 0
+
+
+def disk_budget():
+    global DISK_BUDGET
+    with HTTP_SESSION_LOCK:
+        if DISK_BUDGET is None:
+            DISK_BUDGET = DiskBudget()
+        return DISK_BUDGET
+
+
+class StagingArea:
+    """Fast local scratch directory (SSD, tmpfs) for items in progress.
+
+    Each item is downloaded, transcoded, given its cover and tagged in a
+    directory of its own under root, and only the finished files are moved
+    into the library (see publish_staged). Room for items is reserved
+    through disk_budget()."""
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        os.makedirs(self.root, exist_ok=True)
+
+    def item_dir(self, url):
+        key = video_id_from_url(url) or hashlib.sha1(url.encode()).hexdigest()[:16]
+        return os.path.join(self.root, key)
+
+
+def staging_area():
+    """The process-wide StagingArea, or None when STAGING_DIR is not set."""
+    global STAGING
+    with HTTP_SESSION_LOCK:
+        if STAGING is None and STAGING_DIR:
+            STAGING = StagingArea(STAGING_DIR)
+        return STAGING
+
+
+def publish_staged(path, item_dir, library):
+    """Move everything under item_dir to the same place under library and
+    return where path ended up.
+
+    Each file appears in the library in one step: os.replace when staging
+    and library share a filesystem, otherwise a copy to a temporary name
+    next to the destination that is then renamed over it."""
+    import errno
+
+    for root, _, names in os.walk(item_dir):
+        for name in names:
+            src = os.path.join(root, name)
+            dest = os.path.join(library, os.path.relpath(src, item_dir))
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            try:
+                os.replace(src, dest)
+            except OSError as e:
+                if e.errno != errno.EXDEV:
+                    raise
+                tmp = dest + ".staging"
+                shutil.copy2(src, tmp)
+                os.replace(tmp, dest)
+                os.remove(src)
+    shutil.rmtree(item_dir, ignore_errors=True)
+    return os.path.join(library, os.path.relpath(path, item_dir))
+
+
+RETRY_ATTEMPTS = 5
+RETRY_BASE_DELAY = 2.0
+RATE_LIMIT_BASE_DELAY = 30.0
+RETRY_MAX_DELAY = 300.0
+PERMANENT_ERRORS = (
+    "private video",
+    "video unavailable",
+    "has been removed",
+    "no longer available",
+    "account associated with this video has been terminated",
+    "unsupported url",
+    "is not a valid url",
+    "http error 404",
+    "http error 410",
+    "members-only",
+    "join this channel",
+    "confirm your age",
+    "copyright",
+    "not available in your country",
+    "requested format is not available",
+    "drm protected",
+    "ffmpeg failed",
+)
+RATE_LIMIT_ERRORS = (
+    "http error 429",
+    "too many requests",
+    "rate limit",
+    "rate-limit",
+    "not a bot",
+)
+
+
+def error_chain(e):
+    """e and the exceptions it wraps (yt-dlp exc_info/cause, __cause__, ...)."""
+    seen = []
+    while e is not None and e not in seen:
+        seen.append(e)
+        exc_info = getattr(e, "exc_info", None)
+        e = (
+            (exc_info[1] if isinstance(exc_info, tuple) else None)
+            or getattr(e, "cause", None)
+            or e.__cause__
+            or e.__context__
+        )
+    return seen
+
+
+def classify_error(e):
+    """Return 'permanent', 'rate_limit' or 'transient' for a failed attempt.
+
+    Permanent errors (private or removed videos, unsupported URLs, 404s,
+    full disks, ...) are never retried; rate limits back off longer than
+    other transient errors."""
+    import errno
+
+    chain = error_chain(e)
+    text = " ".join(str(x) for x in chain).lower().replace("\u2019", "'")
+    if any(p in text for p in RATE_LIMIT_ERRORS):
+        return "rate_limit"
+    if any(p in text for p in PERMANENT_ERRORS):
+        return "permanent"
+    for x in chain:
+        if isinstance(x, OSError) and x.errno in (
+            errno.ENOSPC,
+            errno.EACCES,
+            errno.EROFS,
+        ):
+            return "permanent"
+        if type(x).__name__ == "UnsupportedError" or (
+            getattr(x, "expected", False) and not getattr(x, "cause", None)
+        ):
+            return "permanent"
+    return "transient"
+
+
+def retry_delay(kind, attempt, e=None):
+    """Seconds to wait before retry number attempt (1-based): exponential
+    backoff with jitter, or the server's Retry-After when it sent one."""
+    import random
+
+    for x in error_chain(e):
+        response = getattr(x, "response", None)
+        headers = getattr(response, "headers", None) or getattr(x, "headers", None)
+        try:
+            return min(RETRY_MAX_DELAY, float(headers.get("Retry-After")))
+        except (AttributeError, TypeError, ValueError):
+            pass
+    base = RATE_LIMIT_BASE_DELAY if kind == "rate_limit" else RETRY_BASE_DELAY
+    ceiling = min(RETRY_MAX_DELAY, base * 2 ** (attempt - 1))
+    return random.uniform(ceiling / 2, ceiling)
+
+
+JOURNAL_PREFIX = "yt_downloader_journal"
+JOURNAL_STATES = ("queued", "downloading", "downloaded", "transcoded", "tagged", "done")
+
+
+def journal_path(*key):
+    """Journal file for the batch described by key (its URLs, output folder,
+    format, ...), so batches running side by side in one directory each get
+    their own journal."""
+    digest = hashlib.sha1(json.dumps(key, default=str).encode("utf-8")).hexdigest()
+    return f"{JOURNAL_PREFIX}-{digest[:12]}.jsonl"
+
+
+def find_journals():
+    """Journal files left in the working directory by unfinished batches."""
+    return sorted(
+        name
+        for name in os.listdir(".")
+        if name.startswith(JOURNAL_PREFIX) and name.endswith(".jsonl")
+    )
+
+
+def lock_file(f):
+    """Lock the open file f for this process without waiting. Returns False
+    when another process holds the lock. The lock dies with the process, so
+    a killed run never leaves a stale one behind."""
+    try:
+        if sys.platform == "win32":
+            import msvcrt
+
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        return False
+    return True
+
+
+def record_settled(record):
+    """True for a journal record that needs no more work: the item is done,
+    or failed with a permanent error (see classify_error)."""
+    state = (record or {}).get("state")
+    return state == "done" or (state == "failed" and record.get("kind") == "permanent")
+
+
+class JournalBusy(Exception):
+    """Another process is running the batch of this journal."""
+
+
+def journal_stage(filename, url, state, path):
+    """Append url reaching state to the journal file. The journal is opened
+    in append mode everywhere, so lines from worker processes and the main
+    process never overwrite each other."""
+    record = dict(url=url, state=state, path=path, at=time.time())
+    with open(filename, "a", encoding="utf-8") as f:
+        f.write(json.dumps(record) + "\n")
+
+
+class BatchJournal:
+    """Append-only JSONL log of per-item progress through a batch.
+
+    The first line describes the batch (options, mode, format, ...) and every
+    later line records an item reaching a state from JOURNAL_STATES (or
+    'failed'), so an interrupted batch can be resumed exactly where it
+    stopped with --resume: stages whose output still exists are not redone
+    and unfinished downloads continue from their .part files.
+
+    The batch's "plan" (its URLs, selection, ...) is kept in the first line
+    too, so a resumed batch also gets the items the interrupted run never
+    reached (see unfinished_items). A run holds a lock on path + ".lock"
+    while it writes; start() and reopen() raise JournalBusy when another
+    process has it."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = None
+        self._held = None
+
+    def _acquire(self):
+        if self._held:
+            return
+        held = open(self.path + ".lock", "a")
+        if not lock_file(held):
+            held.close()
+            raise JournalBusy(self.path)
+        self._held = held
+
+    def start(self, batch):
+        """Begin a new journal, replacing the one of an earlier run."""
+        self._acquire()
+        with open(self.path, "w", encoding="utf-8") as f:
+            f.write(json.dumps({"batch": batch}) + "\n")
+        self.reopen()
+
+    def reopen(self):
+        self._acquire()
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def _write(self, record):
+        with self._lock:
+            self._file.write(json.dumps(record) + "\n")
+            self._file.flush()
+
+    def record(self, url, state, **fields):
+        self._write(dict(fields, url=url, state=state, at=time.time()))
+
+    def stage_writer(self, url):
+        """Picklable on_stage callback for postprocess_audio that records url's
+        stages from an AudioPipeline worker process."""
+        return functools.partial(journal_stage, os.path.abspath(self.path), url)
+
+    def load(self):
+        """Return (batch, {url: merged record}) in queue order, or (None, {}).
+        URLs are keyed in their canonical form (see canonical_url)."""
+        batch = None
+        items = {}
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # torn last line from a killed process
+                    if "batch" in record:
+                        batch = record["batch"]
+                    else:
+                        url = canonical_url(record["url"])[2]
+                        items.setdefault(url, {}).update(record)
+        except OSError:
+            pass
+        return batch, items
+
+    def settled(self):
+        """True when every item in the journal is done or failed for good."""
+        return all(record_settled(r) for r in self.load()[1].values())
+
+    def close(self, remove=False):
+        if self._file:
+            self._file.close()
+            self._file = None
+        if remove and os.path.exists(self.path):
+            os.remove(self.path)
+        if self._held:
+            self._held.close()
+            self._held = None
+            if remove:
+                with contextlib.suppress(OSError):
+                    os.remove(self.path + ".lock")
+
+
+def extract_cached(ydl, url, use_cache=True):
+    """Extract url without processing it, going through the info cache.
+
+    Returns (info, cached). A fresh extraction is always written to the
+    cache; use_cache=False only skips reading it. download_item discards an
+    entry whose media URLs are refused with a 403."""
+    vid = video_id_from_url(url)
+    cache = info_cache() if vid else None
+    info = cache.get(vid) if cache and use_cache else None
+    if info is not None:
+        return info, True
+    info = ydl.extract_info(url, download=False, process=False)
+    if cache:
+        cache.put(vid, ydl.sanitize_info(info))
+    return info, False
+
+
+def download_item(
+    opts,
+    url,
+    mode,
+    console,
+    fmt,
+    track=None,
+    album=None,
+    do_lyrics=True,
+    max_retries=RETRY_ATTEMPTS,
+    session=None,
+    archive=None,
+    pipeline=None,
+    journal=None,
+    resume=None,
+    attempt=0,
+    defer=None,
+    on_progress=None,
+    timings=None,
+):
+    """Download, postprocess and tag a single URL, retrying as classify_error
+    allows (or handing retries to defer(attempt, delay), which then gets
+    (None, False) back).
+
+    Returns (summary_row, ok); with a pipeline, summary_row is a Future that
+    resolves to (summary_row, ok) once postprocessing has finished."""
+    from concurrent.futures import Future
+
+    def record(state, **fields):
+        if journal:
+            journal.record(url, state, **fields)
+
+    def report(ok, vid, nbytes, stages, attempts=None):
+        if timings is not None:
+            timings.append(
+                dict(
+                    url=url,
+                    id=vid,
+                    ok=ok,
+                    attempts=attempts or retry + 1,
+                    bytes=nbytes,
+                    stages={k: round(v, 4) for k, v in stages.items()},
+                    total=round(sum(stages.values()), 4),
+                )
+            )
+
+    budget = disk_budget() if "paths" in opts else None
+    staging = staging_area() if budget else None
+    item_dir = staging.item_dir(url) if staging else None
+    library = opts["paths"]["home"] if budget else None
+    token = None
+    retry = attempt
+    while True:
+        status = "Success"
+        final_path = None
+        file_type = "Video"
+        size = None
+        conversion = ""
+        proxy = None
+        stages = {}
+        info = {}
+        cached = False
+        try:
+            stage = (resume or {}).get("state")
+            if (
+                mode == "audio"
+                and stage in ("downloaded", "transcoded", "tagged")
+                and os.path.exists(resume.get("path") or "")
+            ):
+                info = resume["info"]
+                final_path = resume["path"]
+            else:
+                stage = "downloaded"
+                record("downloading")
+                ydl_opts = opts
+                if PROXY_POOL:
+                    proxy = PROXY_POOL.acquire()
+                    ydl_opts = dict(opts, proxy=proxy)
+                started = time.monotonic()
+                with session.ydl(ydl_opts, on_progress, item_dir) as ydl:
+                    with timed(stages, "extract"):
+                        # media URLs are tied to the address that extracted
+                        # them, so with a proxy pool every attempt extracts
+                        # through its own proxy
+                        info, cached = extract_cached(ydl, url, not PROXY_POOL)
+                    if budget:
+                        estimate = estimate_bytes(info, mode)
+                        with timed(stages, "admit"):
+                            token = budget.reserve(
+                                estimate or DEFAULT_ITEM_BYTES[mode],
+                                [library] + ([staging.root] if staging else []),
+                                estimate is not None,
+                            )
+                    with timed(stages, "download"):
+                        info = ydl.process_ie_result(info, download=True)
+                if "requested_downloads" in info:
+                    # newer yt-dlp keeps only the format fields here
+                    info = dict(info, **info["requested_downloads"][0])
+                if "filepath" in info:
+                    final_path = info["filepath"]
+                else:
+                    outtmpl = opts.get(
+                        "outtmpl", info.get("title", "audiofile") + "." + fmt
+                    )
+                    final_path = os.path.join(
+                        item_dir or opts.get("paths", {}).get("home", ""),
+                        outtmpl if isinstance(outtmpl, str) else outtmpl.get("default"),
+                    )
+                info = dict(
+                    {k: info.get(k) for k in TAG_FIELDS}, thumbnail=thumbnail_url(info)
+                )
+                record("downloaded", path=final_path, info=info)
+            if final_path and os.path.exists(final_path):
+                size = os.path.getsize(final_path)
+            if proxy:
+                PROXY_POOL.release(proxy, True, size, time.monotonic() - started)
+                proxy = None
+            downloaded = size
+            if mode == "audio" and final_path:
+                file_type = "Audio"
+                with timed(stages, "thumbnail"):
+                    img = fetch_cover(info, console)
+                if pipeline is not None:
+                    processed = pipeline.submit(
+                        postprocess_audio,
+                        final_path,
+                        fmt,
+                        info,
+                        track,
+                        album,
+                        img,
+                        do_lyrics,
+                        None,
+                        stage,
+                        journal.stage_writer(url) if journal else None,
+                        (item_dir, library) if staging else None,
+                    )
+                    done = Future()
+
+                    def finished(
+                        f, raw_path=final_path, vid=info.get("id"), held=token
+                    ):
+                        try:
+                            path, size, conversion, spent = f.result()
+                        except Exception as e:
+                            if held:
+                                budget.settle(held)
+                            console.print(f"❌ Failed to process: {url} - {str(e)}")
+                            record("failed", error=str(e), kind=classify_error(e))
+                            report(False, vid, downloaded, stages)
+                            done.set_result(
+                                ([raw_path, "Audio", f"FAIL: {e}", "", ""], False)
+                            )
+                            return
+                        if held:
+                            budget.settle(held, size)
+                        if archive and vid:
+                            archive.record(vid, fmt, path, size)
+                        record("done", path=path)
+                        report(True, vid, downloaded, dict(stages, **spent))
+                        done.set_result(
+                            (
+                                [
+                                    path,
+                                    "Audio",
+                                    "Success",
+                                    natural_size(size),
+                                    conversion,
+                                ],
+                                True,
+                            )
+                        )
+
+                    processed.add_done_callback(finished)
+                    return done, True
+                final_path, size, conversion, spent = postprocess_audio(
+                    final_path,
+                    fmt,
+                    info,
+                    track,
+                    album,
+                    img,
+                    do_lyrics,
+                    None,
+                    stage,
+                    lambda state, path: record(state, path=path),
+                    (item_dir, library) if staging else None,
+                )
+                stages.update(spent)
+            elif final_path and final_path.lower().endswith(
+                tuple([".mp3", ".flac", ".m4a"])
+            ):
+                file_type = "Audio"
+                with timed(stages, "thumbnail"):
+                    img = fetch_cover(info, console)
+                finish_audio(
+                    final_path, info, fmt, track, album, img, do_lyrics, stages
+                )
+            if staging and final_path and final_path.startswith(item_dir + os.sep):
+                with timed(stages, "publish"):
+                    final_path = publish_staged(final_path, item_dir, library)
+            if token:
+                budget.settle(token, size)
+                token = None
+            if archive and info.get("id") and final_path:
+                archive.record(info["id"], fmt, final_path, size)
+            record("done", path=final_path)
+            report(True, info.get("id"), downloaded, stages)
+            row = [
+                final_path if final_path else url,
+                file_type,
+                status,
+                natural_size(size) if size else "",
+                conversion,
+            ]
+            return row, True
+        except Exception as e:
+            status = f"FAIL: {e}"
+            retry += 1
+            kind = classify_error(e)
+            if token:
+                budget.settle(token)
+                token = None
+            if staging and kind == "permanent":
+                # nothing to resume; a retryable failure keeps its .part file
+                shutil.rmtree(item_dir, ignore_errors=True)
+            if cached and any(
+                "http error 403" in str(x).lower() for x in error_chain(e)
+            ):
+                # the cached media URLs have expired; extract afresh next time
+                info_cache().discard(video_id_from_url(url))
+            if kind == "rate_limit" and not any(
+                getattr(getattr(x, "response", None), "status", None) == 429
+                for x in error_chain(e)
+            ):
+                # bot checks and the like; HTTP 429s were already reported
+                # by paced_urlopen
+                rate_limiter().report(url, kind)
+            if proxy:
+                # a permanent error is the video's fault, not the proxy's
+                PROXY_POOL.release(proxy, None if kind == "permanent" else False)
+            if kind == "permanent" or retry >= max_retries:
+                console.print(f"❌ Failed to download: {url} - {str(e)}")
+                record("failed", error=str(e), kind=kind)
+                report(False, info.get("id"), size, stages, retry)
+                row = [
+                    final_path if final_path else item_label(url, info),
+                    file_type,
+                    status,
+                    natural_size(size) if size else "",
+                    conversion,
+                ]
+                return row, False
+            delay = retry_delay(kind, retry, e)
+            console.print(
+                f"Retrying ({retry}/{max_retries}) for {url} in {delay:.0f}s"
+                f" ({kind.replace('_', ' ')}) ..."
+            )
+            if defer:
+                defer(retry, delay)
+                return None, False
+            time.sleep(delay)
+
+
+def size_order(entries, session, modes, mode, window, resume=None):
+    """Yield entries as (idx, entry) pairs, largest estimated download first
+    among the next `window` entries.
+
+    Entries are extracted ahead of their turn (window at a time) through the
+    info cache, which the downloads then read instead of extracting again.
+    Entries that fail to extract, or report no size, count as
+    DEFAULT_ITEM_BYTES; items resumed past the download count as 0."""
+    from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+    def estimate(entry):
+        url = entry["url"] if isinstance(entry, dict) else entry
+        item_mode = (entry.get("mode") if isinstance(entry, dict) else None) or mode
+        if (resume or {}).get(url, {}).get("state") in JOURNAL_STATES[2:]:
+            return 0
+        try:
+            with session.ydl(modes[item_mode][0]) as ydl:
+                info, _ = extract_cached(ydl, url)
+            nbytes = estimate_bytes(info, item_mode)
+        except Exception:
+            nbytes = None
+        return nbytes or DEFAULT_ITEM_BYTES[item_mode]
+
+    pairs = enumerate(entries, 1)
+    ahead = {}
+    pool = ThreadPoolExecutor(max_workers=window)
+    try:
+        while True:
+            for idx, entry in itertools.islice(pairs, window - len(ahead)):
+                ahead[pool.submit(estimate, entry)] = (idx, entry)
+            if not ahead:
+                return
+            ready = [f for f in ahead if f.done()]
+            if not ready:
+                ready = wait(ahead, return_when=FIRST_COMPLETED).done
+            yield ahead.pop(max(ready, key=lambda f: (f.result(), -ahead[f][0])))
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def download_task(
+    opts,
+    url_list,
+    summary,
+    mode,
+    console,
+    fmt,
+    playlist_seq=None,
+    album=None,
+    do_lyrics=True,
+    max_retries=RETRY_ATTEMPTS,
+    jobs=1,
+    session=None,
+    archive=None,
+    pipeline=None,
+    on_event=None,
+    journal=None,
+    resume=None,
+    timings=None,
+    modes=None,
+):
+    """Download url_list with a pool of `jobs` worker threads, appending one
+    summary row per item in input order. Items are URLs or plan_batch dicts,
+    whose "mode" picks their (opts, fmt) from modes; on_event(url, state,
+    row=None) is called as items start and finish.
+
+    Returns the list of URLs that failed."""
+    from rich.progress import (
+        Progress,
+        BarColumn,
+        DownloadColumn,
+        TextColumn,
+        TimeElapsedColumn,
+        TimeRemainingColumn,
+        TransferSpeedColumn,
+    )
+
+    jobs = max(1, int(jobs or 1))
+    resume = resume or {}
+    modes = dict(modes or {}, **{mode: (opts, fmt)})
+    # url_list may be a generator (streamed playlists); items are URLs or
+    # dicts with "url", "track" and optionally "mode"
+    total_vids = len(url_list) if hasattr(url_list, "__len__") else "?"
+    results = {}
+    results_lock = threading.Lock()
+    work = queue.Queue(maxsize=jobs * 2)
+    # retries waiting out their backoff: heap of (ready_at, idx, item)
+    deferred = []
+    # items handed to workers and not yet finished or deferred
+    active = [0]
+    changed = threading.Condition()
+    own_session = session is None
+    if own_session:
+        session = YDLSession()
+    schedule = enumerate(url_list, 1)
+    budget = disk_budget() if "paths" in opts else None
+    if budget:
+        budget.reset_usage()
+    if budget and total_vids != 1:
+        if info_cache() and not PROXY_POOL:
+            schedule = size_order(url_list, session, modes, mode, jobs * 2, resume)
+        else:
+            console.print(
+                "[dim]Items run in input order: ordering by size needs the "
+                "info cache, which is off (or bypassed for proxies).[/dim]"
+            )
+
+    with Progress(
+        TextColumn("{task.description}"),
+        BarColumn(),
+        "[progress.percentage]{task.percentage:>3.1f}%",
+        DownloadColumn(),
+        TransferSpeedColumn(),
+        TimeElapsedColumn(),
+        TimeRemainingColumn(),
+        console=console,
+    ) as progress:
+
+        def worker(n):
+            row_task = progress.add_task(f"Worker {n}: idle", total=None)
+
+            def on_progress(d):
+                if d.get("status") == "downloading":
+                    progress.update(
+                        row_task,
+                        total=d.get("total_bytes") or d.get("total_bytes_estimate"),
+                        completed=d.get("downloaded_bytes") or 0,
+                    )
+
+            while True:
+                item = work.get()
+                if item is None:
+                    break
+                idx, url, track, attempt, item_mode = item
+                item_opts, item_fmt = modes[item_mode]
+                progress.reset(
+                    row_task,
+                    description=f"Downloading {idx} of {total_vids}: {url}",
+                )
+                if on_event:
+                    on_event(url, "downloading")
+                retry = []
+                row, ok = download_item(
+                    item_opts,
+                    url,
+                    item_mode,
+                    console,
+                    item_fmt,
+                    track,
+                    album,
+                    do_lyrics,
+                    max_retries,
+                    session,
+                    archive,
+                    pipeline,
+                    journal,
+                    resume.get(url),
+                    attempt,
+                    lambda attempt, delay: retry.append(
+                        (
+                            time.monotonic() + delay,
+                            idx,
+                            (idx, url, track, attempt, item_mode),
+                        )
+                    ),
+                    on_progress,
+                    timings,
+                )
+                with changed:
+                    active[0] -= 1
+                    if retry:
+                        heapq.heappush(deferred, retry[0])
+                    changed.notify()
+                if row is None:
+                    progress.update(row_task, description=f"Worker {n}: idle")
+                    continue
+                with results_lock:
+                    results[idx] = (url, row, ok)
+                if on_event and isinstance(row, list):
+                    on_event(url, "done" if ok else "failed", row)
+                elif on_event:
+                    row.add_done_callback(
+                        lambda f, url=url: on_event(
+                            url, "done" if f.result()[1] else "failed", f.result()[0]
+                        )
+                    )
+                progress.update(row_task, description=f"Worker {n}: idle")
+            progress.remove_task(row_task)
+
+        def requeue(wait=False):
+            """Queue the deferred retries that are due. With wait, keep doing
+            so until every item has finished."""
+            while True:
+                with changed:
+                    now = time.monotonic()
+                    if deferred and deferred[0][0] <= now:
+                        item = heapq.heappop(deferred)[2]
+                        active[0] += 1
+                    elif wait and (active[0] or deferred):
+                        changed.wait(deferred[0][0] - now if deferred else None)
+                        continue
+                    else:
+                        return
+                work.put(item)
+
+        workers = [
+            threading.Thread(target=worker, args=(n,), daemon=True)
+            for n in range(
+                1,
+                (jobs if total_vids == "?" else min(jobs, total_vids or 1)) + 1,
+            )
+        ]
+        for t in workers:
+            t.start()
+        for idx, entry in schedule:
+            if isinstance(entry, dict):
+                url, track = entry["url"], entry.get("track")
+                item_mode = entry.get("mode") or mode
+            else:
+                url, item_mode = entry, mode
+                track = playlist_seq[idx - 1] if playlist_seq else None
+            if journal and url not in resume:
+                journal.record(url, "queued", track=track, mode=item_mode)
+            requeue()
+            with changed:
+                active[0] += 1
+            work.put((idx, url, track, 0, item_mode))
+        requeue(wait=True)
+        for _ in workers:
+            work.put(None)
+        for t in workers:
+            t.join()
+    if own_session:
+        session.close()
+
+    pending = sum(1 for _, row, _ in results.values() if not isinstance(row, list))
+    if pending:
+        console.print(f"Waiting for {pending} items to finish processing...")
+    failed = []
+    for idx in sorted(results):
+        url, row, ok = results[idx]
+        if not isinstance(row, list):
+            row, ok = row.result()
+        summary.append(row)
+        if not ok:
+            failed.append(url)
+    if failed:
+        console.print("[bold red]These failed:[/bold red]")
+        for url in failed:
+            console.print(item_label(url))
+    return failed
+
+
+def build_opts(mode, fmt, folder, playlist_mode=False, album=None, connections=1):
+    """Return YoutubeDL options for a batch saved under folder.
+
+    With connections > 1 each download fetches that many DASH/HLS fragments
+    at once and, when aria2c is installed (and USE_ARIA2C), hands plain
+    HTTP downloads to it with as many connections per file. aria2c is not
+    used under a --limit-rate ceiling, which only the native downloader can
+    honour."""
+    fnpat = "%(uploader)s"
+    opts = {}
+    if mode == "audio":
+        if playlist_mode and album:
+            fnpat += os.sep + sanitize(album)
+            outtmpl = os.path.join(fnpat, "%(playlist_index)02d - %(title)s.%(ext)s")
+        elif playlist_mode:
+            outtmpl = os.path.join(fnpat, "%(playlist_index)02d - %(title)s.%(ext)s")
+        else:
+            outtmpl = os.path.join(fnpat, "%(title)s.%(ext)s")
+        # Conversion to fmt happens after download (see plan_audio_conversion)
+        if fmt == "m4a":
+            opts = dict(format="bestaudio[ext=m4a]/bestaudio/best", outtmpl=outtmpl)
+        elif fmt in ("mp3", "flac"):
+            opts = dict(format="bestaudio/best", outtmpl=outtmpl)
+    else:
+        outtmpl = os.path.join(fnpat, "%(title)s.%(ext)s")
+        opts["format"] = "bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best"
+        opts["merge_output_format"] = "mp4"
+        opts["outtmpl"] = outtmpl
+        opts["writesubtitles"] = True
+        opts["embedsubtitles"] = True
+        opts["subtitleslangs"] = ["en"]
+        opts["writeautomaticsub"] = True
+        opts["sponsorblock_remove"] = ["all"]
+    # output templates are relative to the library folder, so a download can
+    # be pointed at a staging directory instead (see StagingArea)
+    opts["paths"] = {"home": os.path.abspath(folder)}
+    if connections and connections > 1:
+        opts["concurrent_fragment_downloads"] = connections
+        if USE_ARIA2C and shutil.which("aria2c") and not rate_limiter().bandwidth:
+            opts["external_downloader"] = {"http": "aria2c"}
+            opts["external_downloader_args"] = {
+                "aria2c": [
+                    f"--split={connections}",
+                    f"--max-connection-per-server={min(connections, 16)}",
+                    "--min-split-size=1M",
+                ]
+            }
+    if COOKIEFILE:
+        opts["cookiefile"] = COOKIEFILE
+    if PROXY:
+        opts["proxy"] = PROXY
+    return opts
+
+
+def print_summary(summary, console):
+    from rich.table import Table
+
+    table = Table(title="Download Summary")
+    table.add_column("File")
+    table.add_column("Type", justify="center")
+    table.add_column("Status", justify="center")
+    table.add_column("Size", justify="right")
+    table.add_column("Audio", justify="center")
+    for row in summary:
+        table.add_row(*[str(x) if x else "" for x in row])
+    console.print(table)
+    if DISK_BUDGET and DISK_BUDGET.items:
+        change = DISK_BUDGET.actual / DISK_BUDGET.projected - 1
+        console.print(
+            f"Disk: projected {natural_size(DISK_BUDGET.projected)}, actual "
+            f"{natural_size(DISK_BUDGET.actual)} ({change:+.0%}) "
+            f"over {DISK_BUDGET.items} items with size estimates"
+        )
+    if PROXY_POOL:
+        console.print(proxy_pool_table(PROXY_POOL))
+
+
+def disk_usage_stats():
+    """Projected and actual bytes of the last batch, for JSON output."""
+    if not DISK_BUDGET:
+        return None
+    return {
+        "items": DISK_BUDGET.items,
+        "projected": DISK_BUDGET.projected,
+        "actual": DISK_BUDGET.actual,
+    }
+
+
+def percentile(values, p):
+    """Nearest-rank p-th percentile (0-100) of values."""
+    values = sorted(values)
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+def write_timings(path, records):
+    """Append timing records from download_task to the JSONL file path."""
+    with open(path, "a", encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+
+
+def export_timings(path, records, console):
+    """--timings: save a batch's records to path and report on them."""
+    if path and records:
+        write_timings(path, records)
+        timing_report(records, console)
+
+
+def load_timings(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def timing_report(records, console):
+    """Print where the time went: per-stage duration percentiles and the
+    spread of download throughput across items."""
+    from rich.table import Table
+
+    table = Table(title=f"Stage timings ({len(records)} items)")
+    for col in ("Stage", "Items", "Total", "p50", "p90", "p99", "Max"):
+        table.add_column(col, justify="left" if col == "Stage" else "right")
+    for stage in TIMING_STAGES + ("total",):
+        values = [
+            r["total"] if stage == "total" else r["stages"][stage]
+            for r in records
+            if stage == "total" or stage in r["stages"]
+        ]
+        if values:
+            table.add_row(
+                stage,
+                str(len(values)),
+                f"{sum(values):.1f}s",
+                *[f"{percentile(values, p):.2f}s" for p in (50, 90, 99, 100)],
+            )
+    console.print(table)
+    timed_downloads = [
+        r for r in records if r.get("bytes") and r["stages"].get("download")
+    ]
+    if timed_downloads:
+        rates = [r["bytes"] / r["stages"]["download"] for r in timed_downloads]
+        overall = sum(r["bytes"] for r in timed_downloads) / sum(
+            r["stages"]["download"] for r in timed_downloads
+        )
+        console.print(
+            "Download throughput per item: "
+            + ", ".join(
+                f"p{p} {natural_size(percentile(rates, p))}/s" for p in (10, 50, 90)
+            )
+            + f"; overall {natural_size(overall)}/s"
+        )
+
+
+SYNC_KNOWN_IDS = 50
+
+
+def iter_new_entries(url, session, known_ids, last_upload_date=None):
+    """Yield the entries of url that no previous sync has seen.
+
+    Channels list their newest uploads first, so paging stops at the first
+    entry seen on a previous run (or older than the newest upload date
+    recorded then). Playlists usually grow at the bottom, so a playlist is
+    listed in full and compared with known_ids."""
+    known = set(known_ids)
+    whole = canonical_url(url)[0] == "playlist"
+    for e in iter_playlist_entries(url, session):
+        if e["id"] in known:
+            if whole:
+                continue
+            break
+        date = e.get("upload_date")
+        if not whole and last_upload_date and date and date < last_upload_date:
+            break
+        yield e
+
+
+def run_sync(
+    targets,
+    console,
+    session,
+    archive,
+    jobs=1,
+    pipeline=None,
+    connections=1,
+    timings=None,
+):
+    """Download whatever is new in each sync target since the previous run.
+
+    A target is {"url", "format", "folder"}. Per-target state (recently seen
+    entry IDs, newest upload date and IDs that failed last time) lives in the
+    archive database. Returns the list of URLs that failed."""
+    failed = []
+    for target in targets:
+        url = target["url"]
+        fmt = target.get("format", "mp3")
+        folder = target.get("folder", "Downloads")
+        mode = "video" if fmt == "mp4" else "audio"
+        state = archive.get_sync_state(url)
+        new = list(
+            iter_new_entries(
+                url, session, state.get("ids", []), state.get("upload_date")
+            )
+        )
+        pending = state.get("pending", [])
+        ids = pending + [e["id"] for e in new if e["id"] not in pending]
+        done = archive.lookup(ids, fmt)
+        todo = [vid for vid in ids if vid not in done]
+        console.print(
+            f"[bold]{url}[/bold]: {len(new)} new, {len(pending)} pending, "
+            f"{len(todo)} to download"
+        )
+        summary = []
+        target_failed = []
+        if todo:
+            if not os.path.exists(folder):
+                os.makedirs(folder)
+            target_failed = download_task(
+                build_opts(mode, fmt, folder, connections=connections),
+                [f"https://www.youtube.com/watch?v={vid}" for vid in todo],
+                summary,
+                mode,
+                console,
+                fmt,
+                jobs=jobs,
+                session=session,
+                archive=archive,
+                pipeline=pipeline,
+                timings=timings,
+            )
+            print_summary(summary, console)
+        failed_ids = [video_id_from_url(u) for u in target_failed]
+        dates = [e["upload_date"] for e in new if e.get("upload_date")]
+        if state.get("upload_date"):
+            dates.append(state["upload_date"])
+        seen = [e["id"] for e in new if e["id"] not in failed_ids]
+        ids = seen + state.get("ids", [])
+        if canonical_url(url)[0] != "playlist":
+            # only the newest few are needed to find where paging stops
+            ids = ids[:SYNC_KNOWN_IDS]
+        archive.set_sync_state(
+            url,
+            {
+                "ids": ids,
+                "upload_date": max(dates) if dates else None,
+                "pending": failed_ids,
+            },
+        )
+        failed.extend(target_failed)
+    return failed
+
+
+EXIT_OK = 0
+EXIT_PARTIAL = 1
+EXIT_USAGE = 2
+EXIT_FAILED = 3
+EXIT_BUSY = 4
+AUDIO_FORMATS = ("mp3", "m4a", "flac")
+
+
+def load_job_file(path):
+    """Read a JSON or YAML job file (YAML needs PyYAML installed)."""
+    with open(path) as f:
+        text = f.read()
+    if path.lower().endswith((".yaml", ".yml")):
+        import yaml
+
+        return yaml.safe_load(text) or {}
+    return json.loads(text)
+
+
+def normalize_job(job, config=None):
+    """Fill in defaults for a batch job and check it.
+
+    A job is a dict with "urls" plus optional "mode" (audio/video), "format",
+    "output", "select" (e.g. "1-3,7", applied to playlists), "jobs",
+    "connections" (per download, see build_opts) and "skip_existing".
+    Without a mode or format the mode is decided per item ("auto_mode").
+    Raises ValueError when the job cannot run."""
+    config = config or {}
+    job = dict(job)
+    urls = list(job.get("urls") or [])
+    if job.get("url"):
+        urls.insert(0, job["url"])
+    if job.get("urls_file"):
+        with open(job["urls_file"]) as f:
+            urls += [x.strip() for x in f if x.strip()]
+    if not urls:
+        raise ValueError("no URLs given")
+    fmt = job.get("format")
+    auto_mode = not job.get("mode") and not fmt
+    mode = job.get("mode") or (
+        "audio"
+        if fmt in AUDIO_FORMATS or all(guess_is_music(u) for u in urls)
+        else "video"
+    )
+    if mode not in ("audio", "video"):
+        raise ValueError(f"unknown mode: {mode}")
+    fmt = fmt or ("mp3" if mode == "audio" else "mp4")
+    if (mode == "audio") != (fmt in AUDIO_FORMATS):
+        raise ValueError(f"format {fmt} does not match mode {mode}")
+    job.update(
+        urls=urls,
+        mode=mode,
+        format=fmt,
+        output=job.get("output") or config.get("last_output_folder", "Downloads"),
+        select=job.get("select") or "",
+        jobs=int(job.get("jobs") or config.get("jobs") or 1),
+        connections=int(job.get("connections") or config.get("connections") or 1),
+        skip_existing=job.get("skip_existing", True),
+        auto_mode=auto_mode,
+    )
+    return job
+
+
+def plan_batch(urls, session, wanted=None, mode=None, stats=None):
+    """Yield one download item per distinct video in urls.
+
+    Every URL is canonicalised first (see canonical_url) and playlists are
+    streamed, restricted to wanted. A video that was already planned, be it
+    in another spelling, listed directly or in another playlist, is dropped
+    and counted in stats["duplicates"], as is a repeated playlist. Items are
+    dicts with "url", "track" and "mode": mode when given, otherwise audio
+    for music.youtube.com links (and the playlists they list) and video for
+    everything else."""
+    seen = set()
+    for raw in urls:
+        item_mode = mode or ("audio" if guess_is_music(raw) else "video")
+        kind, key, url = canonical_url(raw)
+        if kind in ("playlist", "channel") or (kind is None and is_playlist(url)):
+            if ("list", key or url) in seen:
+                if stats is not None:
+                    stats["duplicates"] = stats.get("duplicates", 0) + 1
+                continue
+            seen.add(("list", key or url))
+            items = stream_playlist(url, session, wanted)
+        else:
+            items = [{"url": url, "track": None}]
+        for item in items:
+            vid = video_id_from_url(item["url"]) or item["url"]
+            if vid in seen:
+                if stats is not None:
+                    stats["duplicates"] = stats.get("duplicates", 0) + 1
+                continue
+            seen.add(vid)
+            yield dict(item, mode=item_mode)
+
+
+def batch_items(
+    urls,
+    session,
+    wanted=None,
+    index=None,
+    folder=None,
+    formats=None,
+    archive=None,
+    stats=None,
+    mode=None,
+):
+    """Yield the planned download items (see plan_batch) for a list of video
+    and playlist URLs.
+
+    formats maps each mode to its target format. With index set, anything
+    already in the library or archive is dropped and counted in
+    stats["skipped"]."""
+    for item in plan_batch(urls, session, wanted, mode, stats):
+        if index is not None and in_library(item, index, folder, formats, archive):
+            if stats is not None:
+                stats["skipped"] = stats.get("skipped", 0) + 1
+            continue
+        yield item
+
+
+def in_library(item, index, folder, formats, archive=None):
+    """True when the planned item is already in the library or archive."""
+    todo, _, _ = resume_check(
+        [item["url"]],
+        os.path.abspath(folder),
+        formats[item["mode"]],
+        False,
+        index,
+        archive,
+    )
+    return not todo
+
+
+def unfinished_items(batch, records, session, archive=None, stats=None):
+    """Yield the items of a journaled batch that still need work.
+
+    A batch whose journal holds its plan is planned again from it (see
+    plan_batch), so items the interrupted run never reached are not lost;
+    older journals only know the items they had queued. Items whose record
+    is settled (see record_settled) are left out, as are items never reached
+    that are in the library by now when the batch skips existing files."""
+    plan = batch.get("plan")
+    index = None
+    if plan:
+        if plan.get("skip_existing"):
+            index = LibraryIndex(plan["folder"])
+        items = plan_batch(
+            plan["urls"], session, plan.get("select"), plan.get("mode"), stats
+        )
+    else:
+        items = (
+            {"url": url, "track": r.get("track"), "mode": r.get("mode")}
+            for url, r in records.items()
+        )
+    for item in items:
+        record = records.get(item["url"])
+        if record_settled(record):
+            continue
+        if (
+            record is None
+            and index is not None
+            and in_library(item, index, plan["folder"], plan["formats"], archive)
+        ):
+            if stats is not None:
+                stats["skipped"] = stats.get("skipped", 0) + 1
+            continue
+        yield item
+
+
+def run_batch(
+    job,
+    console,
+    session,
+    archive,
+    pipeline=None,
+    persist_index=False,
+    on_event=None,
+    journal=None,
+    timings=None,
+    resume=None,
+):
+    """Run a normalized job without any prompts, logging it to journal if
+    one is given so it can be continued with --resume. resume holds the
+    journal records of an unfinished earlier run of the job, which is then
+    continued instead. Item timings are appended to the list timings if one
+    is given.
+
+    With job["auto_mode"], music.youtube.com links are saved as mp3 and
+    everything else as mp4 video (see plan_batch).
+
+    Returns (summary, failed_urls, stats) with the "skipped" and
+    "duplicates" counts in stats."""
+    folder = job["output"]
+    fmt = job["format"]
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    wanted = parse_selection(job["select"]) if job["select"].strip() else None
+    index = (
+        LibraryIndex(folder, persist=persist_index) if job["skip_existing"] else None
+    )
+    stats = {"skipped": 0, "duplicates": 0}
+    formats = {job["mode"]: fmt}
+    if job.get("auto_mode"):
+        formats = {"audio": "mp3", "video": "mp4"}
+    modes = {}
+    for mode, mode_fmt in formats.items():
+        opts = build_opts(mode, mode_fmt, folder, connections=job["connections"])
+        opts.update(quiet=True, noprogress=True)
+        modes[mode] = (opts, mode_fmt)
+    opts = modes[job["mode"]][0]
+    plan = dict(
+        urls=job["urls"],
+        select=wanted,
+        mode=None if job.get("auto_mode") else job["mode"],
+        skip_existing=job["skip_existing"],
+        formats=formats,
+        folder=os.path.abspath(folder),
+    )
+    batch = dict(
+        opts=opts,
+        mode=job["mode"],
+        fmt=fmt,
+        modes=modes,
+        jobs=job["jobs"],
+        pipeline=pipeline is not None,
+        headless=True,
+        plan=plan,
+    )
+    if journal and resume is not None:
+        journal.reopen()
+    elif journal:
+        journal.start(batch)
+    if resume is not None:
+        items = unfinished_items(batch, resume, session, archive, stats)
+    else:
+        items = batch_items(
+            plan["urls"],
+            session,
+            wanted,
+            index,
+            folder,
+            formats,
+            archive,
+            stats,
+            plan["mode"],
+        )
+    summary = []
+    failed = download_task(
+        opts,
+        items,
+        summary,
+        job["mode"],
+        console,
+        fmt,
+        jobs=job["jobs"],
+        session=session,
+        archive=archive,
+        pipeline=pipeline,
+        on_event=on_event,
+        journal=journal,
+        resume=resume,
+        timings=timings,
+        modes=modes,
+    )
+    return summary, failed, stats
+
+
+def batch_status(failed, summary):
+    """Return (status, exit_code) for a finished batch."""
+    if not failed:
+        return "ok", EXIT_OK
+    if len(failed) < len(summary):
+        return "partial", EXIT_PARTIAL
+    return "failed", EXIT_FAILED
+
+
+def summary_items(summary):
+    """Summary rows as dicts, for JSON output."""
+    return [
+        dict(zip(("file", "type", "status", "size", "audio"), row)) for row in summary
+    ]
+
+
+def run_headless(args, config, console, persist_index=False):
+    """Entry point for --batch / --job-file. Prints one JSON status line on
+    stdout and returns the process exit code."""
+    job = load_job_file(args.job_file) if args.job_file else {}
+    for key, value in (
+        ("urls", args.url),
+        ("urls_file", args.urls_file),
+        ("mode", args.mode),
+        ("format", args.format),
+        ("output", args.output),
+        ("select", args.select),
+        ("jobs", args.jobs),
+        ("connections", args.connections),
+    ):
+        if value:
+            job[key] = value
+    try:
+        job = normalize_job(job, config)
+    except (ValueError, OSError) as e:
+        console.print(f"[red]Invalid job: {e}[/red]")
+        print(json.dumps({"status": "error", "error": str(e)}))
+        return EXIT_USAGE
+    session = YDLSession()
+    archive = DownloadArchive()
+    pipeline = (
+        AudioPipeline()
+        if args.pipeline and (job["mode"] == "audio" or job["auto_mode"])
+        else None
+    )
+    journal = BatchJournal(
+        args.journal
+        or journal_path(job["urls"], os.path.abspath(job["output"]), job["mode"])
+    )
+    previous, records = journal.load()
+    if previous:
+        console.print(f"Continuing the unfinished run of this batch ({journal.path}).")
+    timings = []
+    try:
+        summary, failed, stats = run_batch(
+            job,
+            console,
+            session,
+            archive,
+            pipeline,
+            persist_index,
+            journal=journal,
+            timings=timings,
+            resume=records if previous else None,
+        )
+    except JournalBusy:
+        console.print(f"[red]Another run of this batch is using {journal.path}.[/red]")
+        print(json.dumps({"status": "busy", "error": f"{journal.path} is in use"}))
+        return EXIT_BUSY
+    finally:
+        session.close()
+        archive.close()
+        if pipeline:
+            pipeline.close()
+    journal.close(remove=journal.settled())
+    print_summary(summary, console)
+    export_timings(args.timings, timings, console)
+    status, code = batch_status(failed, summary)
+    print(
+        json.dumps(
+            {
+                "status": status,
+                "downloaded": len(summary) - len(failed),
+                "skipped": stats["skipped"],
+                "duplicates": stats["duplicates"],
+                "failed": failed,
+                "items": summary_items(summary),
+                "bytes": disk_usage_stats(),
+                "proxies": PROXY_POOL.stats() if PROXY_POOL else None,
+            }
+        )
+    )
+    return code
+
+
+def resume_batch(console, timings_path=None, path=None):
+    """Entry point for --resume: finish the batch in the journal at path (or
+    the only one in the working directory) with the options it was started
+    with (see unfinished_items). Returns the process exit code."""
+    if not path:
+        found = find_journals()
+        if len(found) > 1:
+            console.print("[yellow]Several interrupted batches found:[/yellow]")
+            for name in found:
+                batch, items = BatchJournal(name).load()
+                console.print(f"  {name}: {len(items)} items")
+            console.print("Pick one with --resume --journal FILE.")
+            return EXIT_USAGE
+        path = found[0] if found else None
+    journal = BatchJournal(path) if path else None
+    batch, items = journal.load() if journal else (None, {})
+    if not batch:
+        console.print("[yellow]No interrupted batch to resume.[/yellow]")
+        return EXIT_USAGE
+    try:
+        journal.reopen()
+    except JournalBusy:
+        console.print(f"[red]Another run of this batch is using {path}.[/red]")
+        return EXIT_BUSY
+    settled = sum(1 for r in items.values() if record_settled(r))
+    console.print(f"Resuming batch: {settled} items already finished.")
+    session = YDLSession()
+    archive = DownloadArchive()
+    pipeline = AudioPipeline() if batch.get("pipeline") else None
+    summary = []
+    timings = []
+    stats = {"skipped": 0, "duplicates": 0}
+    try:
+        failed = download_task(
+            batch["opts"],
+            unfinished_items(batch, items, session, archive, stats),
+            summary,
+            batch["mode"],
+            console,
+            batch["fmt"],
+            album=batch.get("album"),
+            do_lyrics=batch.get("do_lyrics", True),
+            jobs=batch.get("jobs", 1),
+            session=session,
+            archive=archive,
+            pipeline=pipeline,
+            journal=journal,
+            resume=items,
+            timings=timings,
+            modes={m: tuple(v) for m, v in (batch.get("modes") or {}).items()},
+        )
+    finally:
+        session.close()
+        archive.close()
+        if pipeline:
+            pipeline.close()
+    journal.close(remove=journal.settled())
+    print_summary(summary, console)
+    export_timings(timings_path, timings, console)
+    status, code = batch_status(failed, summary)
+    if batch.get("headless"):
+        print(
+            json.dumps(
+                {
+                    "status": status,
+                    "downloaded": len(summary) - len(failed),
+                    "skipped": stats["skipped"],
+                    "failed": failed,
+                    "items": summary_items(summary),
+                }
+            )
+        )
+    return code
+
+
+DAEMON_LISTEN = "127.0.0.1:8787"
+
+
+class JobQueue:
+    """Daemon job queue persisted in the archive database.
+
+    Jobs that were running when the daemon stopped are queued again on
+    start."""
+
+    def __init__(self, path=ARCHIVE_FILE):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self.wakeup = threading.Event()
+        with self._db:
+            self._db.execute("""CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    job TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    submitted_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL,
+                    result TEXT
+                )""")
+            self._db.execute(
+                "UPDATE jobs SET status = 'queued', started_at = NULL "
+                "WHERE status = 'running'"
+            )
+
+    def submit(self, job):
+        with self._lock, self._db:
+            cur = self._db.execute(
+                "INSERT INTO jobs (job, status, submitted_at) VALUES (?, 'queued', ?)",
+                (json.dumps(job), time.time()),
+            )
+        self.wakeup.set()
+        return cur.lastrowid
+
+    def claim(self):
+        """Mark the oldest queued job as running and return (id, job), or None."""
+        with self._lock, self._db:
+            row = self._db.execute(
+                "SELECT id, job FROM jobs WHERE status = 'queued' ORDER BY id LIMIT 1"
+            ).fetchone()
+            if row is None:
+                return None
+            self._db.execute(
+                "UPDATE jobs SET status = 'running', started_at = ? WHERE id = ?",
+                (time.time(), row[0]),
+            )
+        return row[0], json.loads(row[1])
+
+    def finish(self, job_id, status, result):
+        with self._lock, self._db:
+            self._db.execute(
+                "UPDATE jobs SET status = ?, finished_at = ?, result = ? WHERE id = ?",
+                (status, time.time(), json.dumps(result), job_id),
+            )
+
+    def cancel(self, job_id):
+        with self._lock, self._db:
+            cur = self._db.execute(
+                "UPDATE jobs SET status = 'cancelled', finished_at = ? "
+                "WHERE id = ? AND status = 'queued'",
+                (time.time(), job_id),
+            )
+        return cur.rowcount > 0
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT id, job, status, submitted_at, started_at, finished_at, "
+                "result FROM jobs WHERE id = ?",
+                (job_id,),
+            ).fetchone()
+        return self._as_dict(row) if row else None
 
+    def list(self, limit=100):
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, job, status, submitted_at, started_at, finished_at, "
+                "NULL FROM jobs ORDER BY id DESC LIMIT ?",
+                (limit,),
+            ).fetchall()
+        return [self._as_dict(r) for r in rows]
 
-def validate_proxy(proxy: str) -> bool:
-    """Return True if proxy looks like a valid proxy URL (has scheme and netloc)."""
-    try:
-        from urllib.parse import urlparse
+    def _as_dict(self, row):
+        keys = ("id", "job", "status", "submitted_at", "started_at", "finished_at")
+        d = dict(zip(keys, row))
+        d["job"] = json.loads(d["job"])
+        if row[6]:
+            d["result"] = json.loads(row[6])
+        return d
 
-        p = urlparse(proxy)
-        return bool(p.scheme and p.netloc)
-    except Exception:
-        return False
 
+class DownloadDaemon:
+    """Long-running downloader serving a small JSON API on a local port.
 
-def sanitize(s):
-    return re.sub(r'[\/\\\:\*\?"<>\|]', "_", s)
+    The YoutubeDL session (and audio pipeline) stay warm between jobs, so a
+    submitted job starts downloading as soon as the previous one is done.
+    Jobs run one at a time, each with its own `jobs` parallelism.
 
+      POST   /jobs       submit a job (same keys as a --job-file); -> {"id": n}
+      GET    /jobs       recent jobs
+      GET    /jobs/<id>  job status, per-item progress and final result
+      DELETE /jobs/<id>  cancel a job that has not started
 
-def resume_check(entries_list, out_folder, fmt, playlist_mode_flag):
-    """Return (to_download_urls, skipped_paths, summary_by_dir).
-    entries_list: list of dicts (playlist) or urls (not used here).
-    For playlists we search recursively under out_folder for expected filenames
-    like '01 - Title.mp3'."""
-    skipped = []
-    to_download = []
-    for_dir_counts = {}
-    if (
-        playlist_mode_flag
-        and isinstance(entries_list, list)
-        and entries_list
-        and isinstance(entries_list[0], dict)
-    ):
-        for e in entries_list:
-            title = sanitize(e.get("title") or "")
-            idx = e.get("index")
-            fname = f"{idx:02d} - {title}.{fmt}"
-            # recursive search for filename under out_folder
-            matches = glob.glob(os.path.join(out_folder, "**", fname), recursive=True)
-            if matches:
-                # pick first match
-                match = matches[0]
-                skipped.append(match)
-                d = os.path.dirname(match)
-                for_dir_counts[d] = for_dir_counts.get(d, 0) + 1
-            else:
-                to_download.append(f"https://www.youtube.com/watch?v={e.get('id')}")
-    else:
-        # Not used for single-video resume per design; treat all as to_download
-        to_download = list(entries_list)
-    return to_download, skipped, for_dir_counts
+    There is no authentication, so requests that a web page could forge are
+    refused: anything sent with an Origin header, and POSTs that are not
+    application/json (which browsers cannot send cross-origin without a
+    preflight). Jobs may not name a urls_file over HTTP.
+    """
 
+    def __init__(self, config, console, use_pipeline=False, persist_index=False):
+        self.config = config
+        self.console = console
+        self.persist_index = persist_index
+        self.queue = JobQueue()
+        self.session = YDLSession()
+        self.archive = DownloadArchive()
+        self.pipeline = AudioPipeline() if use_pipeline else None
+        self.items = {}
+        self._items_lock = threading.Lock()
 
-def download_thumbnail_convert(thumbnail_url):
-    if os.path.exists(thumbnail_url):
-        return thumbnail_url
-    response = requests.get(thumbnail_url, stream=True, timeout=8)
-    ext = os.path.splitext(thumbnail_url)[-1].lower()
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".jpg") as out_img:
-        if ext in [".jpg", ".jpeg"]:
-            for chunk in response.iter_content(1024):
-                out_img.write(chunk)
-        else:
-            with tempfile.NamedTemporaryFile(delete=True, suffix=ext) as temp_orig:
-                for chunk in response.iter_content(1024):
-                    temp_orig.write(chunk)
-                temp_orig.flush()
-                im = Image.open(temp_orig.name).convert("RGB")
-                im.save(out_img, "JPEG")
-        return out_img.name
+    def run_forever(self):
+        while True:
+            claimed = self.queue.claim()
+            if claimed is None:
+                self.queue.wakeup.wait()
+                self.queue.wakeup.clear()
+                continue
+            self.run_job(*claimed)
 
+    def run_job(self, job_id, job):
+        progress = self.items.setdefault(job_id, {})
+
+        def on_event(url, state, row=None):
+            with self._items_lock:
+                item = progress.setdefault(url, {})
+                item["state"] = state
+                if row:
+                    item.update(summary_items([row])[0])
 
-def embed_cover_audiofile(path, img_file, fmt):
-    if fmt == "mp3":
-        audio = None
         try:
-            audio = ID3(path)
-        except:
-            audio = ID3()
-        with open(img_file, "rb") as imgf:
-            audio.add(
-                APIC(
-                    encoding=3,
-                    mime="image/jpeg",
-                    type=3,
-                    desc="Cover",
-                    data=imgf.read(),
-                )
+            job = normalize_job(job, self.config)
+            pipeline = (
+                self.pipeline if job["mode"] == "audio" or job["auto_mode"] else None
             )
-        audio.save(path)
-    elif fmt == "flac":
-        audio = FLAC(path)
-        image = Picture()
-        with open(img_file, "rb") as imgf:
-            image.data = imgf.read()
-        image.type = 3
-        image.mime = "image/jpeg"
-        audio.add_picture(image)
-        audio.save()
+            summary, failed, stats = run_batch(
+                job,
+                self.console,
+                self.session,
+                self.archive,
+                pipeline,
+                self.persist_index,
+                on_event,
+            )
+        except Exception as e:
+            self.queue.finish(job_id, "error", {"error": str(e)})
+            return
+        status = "failed" if failed and len(failed) == len(summary) else "done"
+        self.queue.finish(
+            job_id,
+            status,
+            {
+                "downloaded": len(summary) - len(failed),
+                "skipped": stats["skipped"],
+                "duplicates": stats["duplicates"],
+                "failed": failed,
+                "items": summary_items(summary),
+                "bytes": disk_usage_stats(),
+            },
+        )
 
+    def job_status(self, job_id):
+        job = self.queue.get(job_id)
+        if job is not None and job_id in self.items:
+            with self._items_lock:
+                job["items"] = {u: dict(i) for u, i in self.items[job_id].items()}
+        return job
 
-def write_tags(path, info, fmt, idx=None, album=None):
-    tags = {}
-    tags["title"] = info.get("title", "")
-    tags["artist"] = info.get("uploader") or info.get("channel") or ""
-    tags["album"] = album or info.get("album") or info.get("playlist_title") or ""
-    tags["date"] = str(info.get("release_year", "") or info.get("upload_date", "")[:4])
-    tags["genre"] = info.get("genre", "")
-    if idx:
-        tags["tracknumber"] = str(idx)
-    if fmt == "mp3":
-        try:
-            audio = EasyID3(path)
-        except Exception:
-            audio = EasyID3()
-        for k, v in tags.items():
-            if v:
-                audio[k] = v
-        audio.save(path)
-    elif fmt == "flac":
-        audio = FLAC(path)
-        for k, v in tags.items():
-            if v:
-                audio[k] = v
-        audio.save()
+    def serve(self, listen=DAEMON_LISTEN):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
+        daemon = self
 
-def save_yt_description(path, desc):
-    if desc:
-        fn = os.path.splitext(path)[0] + ".txt"
-        with open(fn, "w", encoding="utf-8") as f:
-            f.write(desc)
+        class Handler(BaseHTTPRequestHandler):
+            def reply(self, code, body):
+                data = json.dumps(body).encode()
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
 
+            def job_id(self):
+                m = re.fullmatch(r"/jobs/(\d+)", self.path.rstrip("/"))
+                return int(m.group(1)) if m else None
 
-def download_task(
-    opts,
-    url_list,
-    summary,
-    mode,
-    console,
-    fmt,
-    playlist_seq=None,
-    album=None,
-    do_lyrics=True,
-    max_retries=2,
-):
-    from yt_dlp import YoutubeDL
+            def forged(self):
+                """Refuse requests a web page could have sent."""
+                if self.headers.get("Origin"):
+                    self.reply(403, {"error": "browser requests are not accepted"})
+                    return True
+                return False
 
-    with Progress(
-        TextColumn("{task.description}"),
-        BarColumn(),
-        "[progress.percentage]{task.percentage:>3.1f}%",
-        TimeElapsedColumn(),
-        TimeRemainingColumn(),
-    ) as progress:
-        total_vids = len(url_list)
-        failed = []
-        for idx, url in enumerate(url_list, 1):
-            retry = 0
-            while retry < max_retries:
-                task = progress.add_task(
-                    f"Downloading {idx} of {total_vids}: {url}", total=None
-                )
-                status = "Success"
-                final_path = None
-                file_type = "Video"
-                size = None
-                try:
-                    with YoutubeDL(opts) as ydl:
-                        info = ydl.extract_info(url, download=True)
-                        if "requested_downloads" in info:
-                            info = info["requested_downloads"][0]
-                        if "filepath" in info:
-                            final_path = info["filepath"]
-                        else:
-                            outtmpl = opts.get(
-                                "outtmpl", info.get("title", "audiofile") + "." + fmt
-                            )
-                            final_path = (
-                                outtmpl
-                                if isinstance(outtmpl, str)
-                                else outtmpl.get("default")
-                            )
-                        if final_path and os.path.exists(final_path):
-                            size = os.path.getsize(final_path)
-                        if mode == "audio" or (
-                            final_path
-                            and final_path.lower().endswith(
-                                tuple([".mp3", ".flac", ".m4a"])
-                            )
-                        ):
-                            file_type = "Audio"
-                            tn_url = info.get("thumbnail")
-                            if not tn_url:
-                                t_list = info.get("thumbnails", [])
-                                tn_url = t_list[-1]["url"] if t_list else None
-                            print("Thumbnail URL:", tn_url)
-                            if tn_url and final_path:
-                                try:
-                                    img = download_thumbnail_convert(tn_url)
-                                    print("Downloaded image file:", img)
-                                    embed_cover_audiofile(final_path, img, fmt)
-                                    if (
-                                        img
-                                        and os.path.exists(img)
-                                        and not os.path.abspath(img).endswith(
-                                            "default.jpg"
-                                        )
-                                    ):
-                                        os.remove(img)
-                                except Exception as e:
-                                    print("Thumbnail error:", e)
-                            else:
-                                print("No thumbnail found for this audio.")
-                            ix = playlist_seq[idx - 1] if playlist_seq else None
-                            write_tags(final_path, info, fmt, ix, album)
-                            if do_lyrics:
-                                save_yt_description(final_path, info.get("description"))
-                    summary.append(
-                        [
-                            final_path if final_path else url,
-                            file_type,
-                            status,
-                            natural_size(size) if size else "",
-                        ]
+            def do_GET(self):
+                if self.forged():
+                    return
+                if self.path.rstrip("/") == "/jobs":
+                    return self.reply(200, daemon.queue.list())
+                job_id = self.job_id()
+                job = daemon.job_status(job_id) if job_id else None
+                if job is None:
+                    return self.reply(404, {"error": "not found"})
+                self.reply(200, job)
+
+            def do_POST(self):
+                if self.forged():
+                    return
+                if self.path.rstrip("/") != "/jobs":
+                    return self.reply(404, {"error": "not found"})
+                content_type = self.headers.get("Content-Type") or ""
+                if content_type.split(";")[0].strip().lower() != "application/json":
+                    return self.reply(
+                        415, {"error": "use Content-Type: application/json"}
                     )
-                    progress.remove_task(task)
-                    break
-                except Exception as e:
-                    status = f"FAIL: {e}"
-                    retry += 1
-                    progress.remove_task(task)
-                    if retry >= max_retries:
-                        console.print(f"❌ Failed to download: {url} - {str(e)}")
-                        failed.append(url)
-                        summary.append(
-                            [
-                                final_path if final_path else url,
-                                file_type,
-                                status,
-                                natural_size(size) if size else "",
-                            ]
-                        )
-                        break
-                    else:
-                        console.print(f"Retrying ({retry}/{max_retries}) for {url} ...")
-                        continue
-        if failed:
-            console.print("[bold red]These failed:[/bold red]")
-            for url in failed:
-                console.print(url)
+                try:
+                    length = int(self.headers.get("Content-Length") or 0)
+                    job = json.loads(self.rfile.read(length) or b"{}")
+                    if not isinstance(job, dict):
+                        raise ValueError("a job must be a JSON object")
+                    if "urls_file" in job:
+                        raise ValueError("urls_file is not accepted over HTTP")
+                    normalize_job(job, daemon.config)
+                except (ValueError, OSError) as e:
+                    return self.reply(400, {"error": str(e)})
+                self.reply(201, {"id": daemon.queue.submit(job)})
+
+            def do_DELETE(self):
+                if self.forged():
+                    return
+                job_id = self.job_id()
+                if job_id and daemon.queue.cancel(job_id):
+                    return self.reply(200, {"id": job_id, "status": "cancelled"})
+                self.reply(409, {"error": "job is not queued"})
+
+            def log_message(self, format, *args):
+                pass
+
+        host, _, port = listen.rpartition(":")
+        server = ThreadingHTTPServer((host or "127.0.0.1", int(port)), Handler)
+        threading.Thread(target=self.run_forever, daemon=True).start()
+        self.console.print(f"Downloader daemon listening on http://{listen}/jobs")
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+            self.session.close()
+            if self.pipeline:
+                self.pipeline.close()
 
 
 def open_folder(path):
@@ -426,11 +3535,18 @@ def has_gui_open() -> bool:
 
 
 def pick_audio_format():
+    from rich.prompt import Prompt
+
     ch = Prompt.ask("Pick audio format", choices=["mp3", "m4a", "flac"], default="mp3")
     return ch
 
 
 def main():
+    global INFO_CACHE_TTL, STAGING_DIR, DISK_BUDGET
+    from rich.console import Console
+    from rich.prompt import Prompt, Confirm
+    from rich.table import Table
+
     console = Console()
     parser = argparse.ArgumentParser(add_help=False)
     parser.add_argument(
@@ -444,14 +3560,162 @@ def main():
     )
     parser.add_argument(
         "--config",
-        help="Config subcommand: 'set-proxy', 'clear-proxy', 'show'",
-        choices=["set-proxy", "clear-proxy", "show"],
+        help="Config subcommand: 'set-proxy', 'add-proxy', 'remove-proxy', "
+        "'clear-proxy', 'show' (add-proxy/remove-proxy manage the proxy pool)",
+        choices=["set-proxy", "add-proxy", "remove-proxy", "clear-proxy", "show"],
+        default=None,
+    )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        help="Number of items to download in parallel (default: 1)",
+        default=None,
+    )
+    parser.add_argument(
+        "--connections",
+        type=int,
+        help="Connections per download: fetch this many DASH/HLS fragments at "
+        "once and use aria2c for plain downloads when it is installed",
+        default=None,
+    )
+    parser.add_argument(
+        "--no-aria2c",
+        action="store_true",
+        help="Never hand downloads to aria2c, even with --connections",
+    )
+    parser.add_argument(
+        "--persist-index",
+        action="store_true",
+        help="Keep a library index in the output folder to speed up resume checks",
+    )
+    parser.add_argument(
+        "--import-archive",
+        metavar="FOLDER",
+        help="Backfill the download archive from an existing library and exit",
+        default=None,
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Start downloading playlist items while the playlist is still being listed",
+    )
+    parser.add_argument(
+        "--pipeline",
+        action="store_true",
+        help="Convert and tag audio in a separate process pool while downloads continue",
+    )
+    parser.add_argument(
+        "--no-update-check",
+        action="store_true",
+        help="Do not check PyPI for yt-dlp updates (also YT_DOWNLOADER_NO_UPDATE_CHECK=1)",
+    )
+    parser.add_argument(
+        "--sync",
+        nargs="*",
+        metavar="URL",
+        help="Download what is new in the saved sync playlists/channels and exit; "
+        "URLs given here are added to the sync list first",
+        default=None,
+    )
+    parser.add_argument(
+        "--format",
+        choices=["mp3", "m4a", "flac", "mp4"],
+        help="Format for --batch and new sync targets "
+        "(default: mp3 for YouTube Music, else mp4)",
+        default=None,
+    )
+    parser.add_argument(
+        "--output",
+        "-o",
+        help="Output folder for --batch and new sync targets",
+        default=None,
+    )
+    parser.add_argument(
+        "--batch",
+        action="store_true",
+        help="Run without prompts using --url/--urls-file/--job-file and exit; "
+        "prints a JSON status line (exit 0 ok, 1 partial, 2 bad job, 3 all failed)",
+    )
+    parser.add_argument(
+        "--job-file", help="JSON or YAML job file for --batch", default=None
+    )
+    parser.add_argument(
+        "--url", action="append", help="URL to download (repeatable)", default=None
+    )
+    parser.add_argument("--urls-file", help="Text file with one URL per line")
+    parser.add_argument("--mode", choices=["audio", "video"], default=None)
+    parser.add_argument(
+        "--select", help="Playlist items to download, e.g. 1-3,7", default=None
+    )
+    parser.add_argument(
+        "--limit-rate",
+        help="Bandwidth ceiling shared by all downloads, e.g. 500K or 4M (bytes/s)",
+        default=None,
+    )
+    parser.add_argument(
+        "--requests-per-second",
+        type=float,
+        help=f"Most requests per second to one host (default {REQUESTS_PER_SECOND:g}, "
+        "0 for no limit); lowered automatically on 429s and server errors",
+        default=None,
+    )
+    parser.add_argument(
+        "--staging-dir",
+        metavar="DIR",
+        help="Download, convert and tag in DIR (e.g. a local SSD or tmpfs) and "
+        "move finished files into the output folder",
+        default=None,
+    )
+    parser.add_argument(
+        "--min-free-mb",
+        type=int,
+        metavar="MB",
+        help=f"Space to keep free on the output and staging disks "
+        f"(default {MIN_FREE_BYTES // 1024 // 1024})",
+        default=None,
+    )
+    parser.add_argument(
+        "--info-cache-ttl",
+        type=float,
+        metavar="SECONDS",
+        help=f"Reuse extracted video info for this long (default {INFO_CACHE_TTL}, "
+        "0 to always extract afresh)",
+        default=None,
+    )
+    parser.add_argument(
+        "--timings",
+        metavar="FILE",
+        help="Append per-item stage timings to FILE as JSON lines and print a "
+        "percentile report after each batch",
+        default=None,
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Continue the last interrupted batch from its journal",
+    )
+    parser.add_argument(
+        "--journal",
+        metavar="FILE",
+        help="Journal file for this batch (default: one per batch in the working "
+        "directory); with --resume, the batch to continue",
+        default=None,
+    )
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        help="Run as a background service accepting jobs over a local HTTP API",
+    )
+    parser.add_argument(
+        "--listen",
+        help=f"host:port for --daemon (default {DAEMON_LISTEN})",
         default=None,
     )
     args, _ = parser.parse_known_args()
     env_cookie = os.environ.get("YT_DOWNLOADER_COOKIES")
     env_proxy = os.environ.get("YT_DOWNLOADER_PROXY")
-    global COOKIEFILE, PROXY
+    global COOKIEFILE, PROXY, PROXY_POOL, THUMBNAIL_CACHE, RATE_LIMITER, USE_ARIA2C
     config = load_config()
     # Handle simple config subcommands non-interactively
     if args.config:
@@ -459,8 +3723,9 @@ def main():
             console.print(json.dumps(config, indent=2))
             sys.exit(0)
         if args.config == "clear-proxy":
-            if "proxy" in config:
-                del config["proxy"]
+            if "proxy" in config or "proxies" in config:
+                config.pop("proxy", None)
+                config.pop("proxies", None)
                 save_config(config)
                 console.print("[green]Proxy cleared from config.[/green]")
             else:
@@ -470,9 +3735,12 @@ def main():
             # If CLI proxy provided, use that; otherwise prompt interactively
             if args.proxy:
                 if validate_proxy(args.proxy):
-                    config["proxy"] = args.proxy
-                    save_config(config)
-                    console.print("[green]Proxy saved to config.[/green]")
+                    replaced = save_proxy(config, args.proxy)
+                    console.print(
+                        "[green]Proxy saved to config"
+                        + (f", replacing a pool of {replaced}." if replaced else ".")
+                        + "[/green]"
+                    )
                 else:
                     console.print("[red]Provided proxy is invalid.[/red]")
             else:
@@ -482,12 +3750,47 @@ def main():
                 )
                 if p:
                     if validate_proxy(p):
-                        config["proxy"] = p
-                        save_config(config)
-                        console.print("[green]Proxy saved to config.[/green]")
+                        replaced = save_proxy(config, p)
+                        console.print(
+                            "[green]Proxy saved to config"
+                            + (
+                                f", replacing a pool of {replaced}."
+                                if replaced
+                                else "."
+                            )
+                            + "[/green]"
+                        )
                     else:
                         console.print("[red]Invalid proxy URL. Nothing saved.[/red]")
             sys.exit(0)
+        if args.config in ("add-proxy", "remove-proxy"):
+            p = args.proxy or Prompt.ask(
+                "Enter proxy URL (empty to cancel)", default=""
+            )
+            if not p:
+                sys.exit(0)
+            pool = config_proxies(config)
+            if args.config == "add-proxy":
+                if not validate_proxy(p):
+                    console.print("[red]Invalid proxy URL. Nothing saved.[/red]")
+                    sys.exit(0)
+                if p not in pool:
+                    pool.append(p)
+            elif p in pool:
+                pool.remove(p)
+            else:
+                console.print("[yellow]That proxy is not in the pool.[/yellow]")
+                sys.exit(0)
+            config.pop("proxy", None)
+            config["proxies"] = pool
+            save_config(config)
+            console.print(f"[green]Proxy pool saved ({len(pool)} proxies).[/green]")
+            sys.exit(0)
+    if args.import_archive:
+        archive = DownloadArchive()
+        import_archive(args.import_archive, archive, console)
+        archive.close()
+        sys.exit(0)
     if args.cookies:
         COOKIEFILE = args.cookies if os.path.exists(args.cookies) else None
         if COOKIEFILE:
@@ -500,20 +3803,147 @@ def main():
         if cfg_cookie and os.path.exists(cfg_cookie):
             COOKIEFILE = cfg_cookie
 
-    # Proxy precedence: CLI arg > env var > config file
+    # Proxy precedence: CLI arg > env var > config file. Several proxies (comma
+    # separated in the env var, or the config's pool) are used as a ProxyPool.
     if args.proxy:
         PROXY = args.proxy
-        config["proxy"] = PROXY
-        save_config(config)
+        if save_proxy(config, PROXY):
+            console.print("[yellow]--proxy replaces the saved proxy pool.[/yellow]")
     elif env_proxy:
-        PROXY = env_proxy
+        proxies = [p.strip() for p in env_proxy.split(",") if p.strip()]
     else:
-        cfg_proxy = config.get("proxy")
-        if cfg_proxy:
-            PROXY = cfg_proxy
+        proxies = config_proxies(config)
+    if not args.proxy:
+        for p in proxies:
+            if not validate_proxy(p):
+                console.print(f"[yellow]Ignoring invalid proxy URL: {p}[/yellow]")
+        proxies = [p for p in proxies if validate_proxy(p)]
+        if len(proxies) > 1:
+            PROXY_POOL = ProxyPool(
+                proxies,
+                config.get("proxy_probe_url", PROXY_PROBE_URL),
+                config.get("proxy_probe_interval"),
+            )
+            PROXY_POOL.start()
+        elif proxies:
+            PROXY = proxies[0]
+
+    jobs = args.jobs or config.get("jobs") or 1
+    if args.jobs:
+        config["jobs"] = args.jobs
+        save_config(config)
+    connections = args.connections or config.get("connections") or 1
+    USE_ARIA2C = not args.no_aria2c and config.get("aria2c", True)
+    persist_index = args.persist_index or config.get("persist_index", False)
+    if args.persist_index:
+        config["persist_index"] = True
+        save_config(config)
+    stream_playlists = args.stream
+    try:
+        RATE_LIMITER = RateLimiter(
+            parse_rate(args.limit_rate or config.get("limit_rate") or 0),
+            float(
+                args.requests_per_second
+                if args.requests_per_second is not None
+                else config.get("requests_per_second", REQUESTS_PER_SECOND)
+            ),
+        )
+    except ValueError as e:
+        console.print(f"[red]{e}[/red]")
+        sys.exit(EXIT_USAGE)
+    THUMBNAIL_CACHE = ThumbnailCache(
+        config.get("thumbnail_cache_dir", THUMBNAIL_CACHE_DIR),
+        int(config.get("thumbnail_cache_mb", 100)) * 1024 * 1024,
+    )
+    STAGING_DIR = args.staging_dir or config.get("staging_dir")
+    min_free_mb = (
+        args.min_free_mb
+        if args.min_free_mb is not None
+        else config.get("min_free_mb", MIN_FREE_BYTES // 1024 // 1024)
+    )
+    DISK_BUDGET = DiskBudget(int(min_free_mb) * 1024 * 1024)
+    INFO_CACHE_TTL = float(
+        args.info_cache_ttl
+        if args.info_cache_ttl is not None
+        else config.get("info_cache_ttl", INFO_CACHE_TTL)
+    )
+    use_pipeline = args.pipeline
+
+    if args.daemon:
+        listen = args.listen or config.get("daemon_listen", DAEMON_LISTEN)
+        daemon = DownloadDaemon(
+            config, Console(stderr=True), args.pipeline, persist_index
+        )
+        try:
+            daemon.serve(listen)
+        except KeyboardInterrupt:
+            pass
+        sys.exit(0)
+
+    if args.resume:
+        sys.exit(resume_batch(console, args.timings, args.journal))
+
+    if args.batch or args.job_file:
+        sys.exit(run_headless(args, config, Console(stderr=True), persist_index))
+
+    if args.sync is not None:
+        targets = config.get("sync", [])
+        known = {t["url"] for t in targets}
+        for u in args.sync:
+            if u in known:
+                continue
+            targets.append(
+                {
+                    "url": u,
+                    "format": args.format or ("mp3" if guess_is_music(u) else "mp4"),
+                    "folder": args.output
+                    or config.get("last_output_folder", "Downloads"),
+                }
+            )
+            known.add(u)
+        if args.sync:
+            config["sync"] = targets
+            save_config(config)
+        if not targets:
+            console.print(
+                "[yellow]No sync targets saved. Pass URLs to --sync to add some.[/yellow]"
+            )
+            sys.exit(0)
+        session = YDLSession()
+        archive = DownloadArchive()
+        pipeline = AudioPipeline() if use_pipeline else None
+        timings = []
+        try:
+            failed = run_sync(
+                targets,
+                console,
+                session,
+                archive,
+                jobs,
+                pipeline,
+                connections,
+                timings,
+            )
+        finally:
+            session.close()
+            archive.close()
+            if pipeline:
+                pipeline.close()
+        export_timings(args.timings, timings, console)
+        sys.exit(1 if failed else 0)
+
+    # The update check runs in the background while the prompts are answered
+    updater = None
+    if not (
+        args.no_update_check
+        or os.environ.get("YT_DOWNLOADER_NO_UPDATE_CHECK")
+        or config.get("check_updates") is False
+    ):
+        updater = UpdateChecker(config, config.get("update_check_ttl_hours", 24))
+        updater.start()
 
     # If still no proxy, offer to set one interactively
-    if not PROXY:
+    if not PROXY and not PROXY_POOL:
         try:
             if Confirm.ask(
                 "No proxy configured. Would you like to set a proxy now?", default=False
@@ -542,15 +3972,22 @@ def main():
         )
     if PROXY:
         console.print(f"Using proxy: [green]{PROXY}[/green]")
+    elif PROXY_POOL:
+        console.print(
+            f"Using a pool of [green]{len(PROXY_POOL)}[/green] proxies; "
+            "each item goes to the fastest healthy one."
+        )
     else:
         console.print(
             "No proxy configured. To set one, use --proxy / -p or set YT_DOWNLOADER_PROXY or save it in config."
         )
 
+    archive = DownloadArchive()
+
     while True:
         try:
             ensure_dirs()
-            check_yt_dlp_update(console)
+            check_yt_dlp_update(console, updater)
         except GracefulExit:
             sys.exit(0)
         config = load_config()
@@ -587,7 +4024,8 @@ def main():
                 console.print("\n[red]Operation cancelled by user.[/red]")
                 sys.exit(0)
         url = urls[0]
-        use_video = not guess_is_music(url)
+        music = [guess_is_music(u) for u in urls]
+        use_video = not all(music)
         pick_audio = False
         fmt = "mp3"
         if use_video:
@@ -596,21 +4034,86 @@ def main():
                 fmt = pick_audio_format()
         else:
             fmt = pick_audio_format()
-        mode = "audio" if guess_is_music(url) or pick_audio else "video"
+        mode = "audio" if not use_video or pick_audio else "video"
+        if mode == "video":
+            fmt = "mp4"
+        formats = {mode: fmt}
+        if mode == "video" and any(music):
+            # in a mixed list, music.youtube.com links are still saved as audio
+            console.print(
+                f"{sum(music)} music.youtube.com links will be saved as audio."
+            )
+            formats["audio"] = pick_audio_format()
         folder = Prompt.ask("Output folder", default=last_output_folder)
         if not os.path.exists(folder):
             os.makedirs(folder)
         config["last_output_folder"] = folder
         save_config(config)
-        opts = {}
         playlist_mode = False
         playlist_indices = None
         playlist_urls = []
         playlist_seq = None
         album = None
-        if is_playlist(url):
+        session = YDLSession()
+        streamed = None
+        planned = None
+        skip_existing = False
+        # what the journal needs to plan the batch again on --resume
+        plan = dict(
+            urls=urls,
+            select=None,
+            mode=mode,
+            formats=formats,
+            folder=os.path.abspath(folder),
+        )
+        if input_was_file:
+            plan["mode"] = "audio" if mode == "audio" else None
+            stats = {"duplicates": 0}
+            with console.status("Planning batch..."):
+                planned = list(
+                    plan_batch(
+                        urls,
+                        session,
+                        mode="audio" if mode == "audio" else None,
+                        stats=stats,
+                    )
+                )
+            console.print(
+                f"[bold]{len(planned)} videos planned from {len(urls)} URLs[/bold]"
+                + (
+                    f", {stats['duplicates']} duplicates dropped."
+                    if stats["duplicates"]
+                    else "."
+                )
+            )
+        elif is_playlist(url) and stream_playlists:
+            playlist_mode = True
+            try:
+                sel = Prompt.ask(
+                    "Enter numbers or ranges to download (e.g. 1,2,5-7) or leave blank for all",
+                    default="",
+                )
+                skip_existing = Confirm.ask(
+                    "Check Downloads folder and skip files that already exist?",
+                    default=True,
+                )
+            except KeyboardInterrupt:
+                console.print("\n[red]Operation cancelled by user.[/red]")
+                sys.exit(0)
+            wanted = parse_selection(sel) if sel.strip() else None
+            plan["select"] = wanted
+            streamed = stream_playlist(
+                url,
+                session,
+                wanted,
+                LibraryIndex(folder, persist=persist_index) if skip_existing else None,
+                folder,
+                fmt,
+                archive,
+            )
+        elif is_playlist(url):
             playlist_mode = True
-            entries = fetch_playlist_entries(url)
+            entries = fetch_playlist_entries(url, session)
             console.print(
                 f"[bold]Playlist detected. {len(entries)} videos found:[/bold]"
             )
@@ -626,7 +4129,6 @@ def main():
                 sys.exit(0)
             if sel.strip():
                 playlist_indices = parse_selection(sel, len(entries))
-                opts["playlist_items"] = ",".join(str(i) for i in playlist_indices)
             else:
                 playlist_indices = list(range(1, len(entries) + 1))
             for ix in playlist_indices:
@@ -634,124 +4136,45 @@ def main():
                 playlist_urls.append(f"https://www.youtube.com/watch?v={entry['id']}")
             playlist_seq = list(range(1, len(playlist_urls) + 1))
             album = entries[0].get("playlist_title") or None
-        fnpat = "%(uploader)s"
-        if mode == "audio":
-            if playlist_mode and album:
-                fnpat += os.sep + sanitize(album)
-                outtmpl = os.path.join(
-                    folder, fnpat, "%(playlist_index)02d - %(title)s.%(ext)s"
-                )
-            elif playlist_mode:
-                outtmpl = os.path.join(
-                    folder, fnpat, "%(playlist_index)02d - %(title)s.%(ext)s"
-                )
-            else:
-                outtmpl = os.path.join(folder, fnpat, "%(title)s.%(ext)s")
-            if fmt == "mp3":
-                opts = dict(
-                    format="bestaudio/best",
-                    extractaudio=True,
-                    audioformat="mp3",
-                    postprocessors=[
-                        {"key": "FFmpegExtractAudio", "preferredcodec": "mp3"}
-                    ],
-                    outtmpl=outtmpl,
-                )
-            elif fmt == "m4a":
-                opts = dict(
-                    format="bestaudio[ext=m4a]/bestaudio/best",
-                    extractaudio=True,
-                    audioformat="m4a",
-                    postprocessors=[
-                        {"key": "FFmpegExtractAudio", "preferredcodec": "m4a"}
-                    ],
-                    outtmpl=outtmpl,
-                )
-            elif fmt == "flac":
-                opts = dict(
-                    format="bestaudio/best",
-                    extractaudio=True,
-                    audioformat="flac",
-                    postprocessors=[
-                        {"key": "FFmpegExtractAudio", "preferredcodec": "flac"}
-                    ],
-                    outtmpl=outtmpl,
-                )
-            if COOKIEFILE:
-                opts["cookiefile"] = COOKIEFILE
-            if PROXY:
-                opts["proxy"] = PROXY
-        else:
-            outtmpl = os.path.join(folder, fnpat, "%(title)s.%(ext)s")
-            opts["format"] = "bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best"
-            opts["merge_output_format"] = "mp4"
-            opts["outtmpl"] = outtmpl
-            opts["writesubtitles"] = True
-            opts["embedsubtitles"] = True
-            opts["subtitleslangs"] = ["en"]
-            opts["writeautomaticsub"] = True
-            opts["sponsorblock_remove"] = ["all"]
-            if COOKIEFILE:
-                opts["cookiefile"] = COOKIEFILE
-            if PROXY:
-                opts["proxy"] = PROXY
+            plan["select"] = playlist_indices
+        pipeline = AudioPipeline() if use_pipeline and "audio" in formats else None
+        opts = build_opts(mode, fmt, folder, playlist_mode, album, connections)
+        modes = {
+            m: (build_opts(m, f, folder, connections=connections), f)
+            for m, f in formats.items()
+            if m != mode
+        }
         summary = []
         urls_to_download = playlist_urls if playlist_mode else urls
+        if streamed is not None:
+            urls_to_download = streamed
+        elif planned is not None:
+            urls_to_download = planned
 
         # If this was a playlist or the URLs were loaded from a file, offer a resume check
-        def resume_check(entries_list, out_folder, fmt, playlist_mode_flag):
-            """Return (to_download_urls, skipped_count). entries_list is list of dicts with title/id or list of urls."""
-            skipped = []
-            to_download = []
-            if (
-                playlist_mode_flag
-                and isinstance(entries_list, list)
-                and entries_list
-                and isinstance(entries_list[0], dict)
-            ):
-                # Build expected filenames for playlist entries
-                for e in entries_list:
-                    title = sanitize(e.get("title") or "")
-                    idx = e.get("index")
-                    fname = f"{idx:02d} - {title}.{fmt}"
-                    path = os.path.join(out_folder, fname)
-                    if os.path.exists(path):
-                        skipped.append(path)
-                    else:
-                        to_download.append(
-                            f"https://www.youtube.com/watch?v={e.get('id')}"
-                        )
-            else:
-                # entries_list is list of urls; check by title extraction is expensive, so check by filename existence heuristics
-                for u in entries_list:
-                    # try to guess title from url id
-                    vid = None
-                    m = re.search(r"v=([\w-]+)", u)
-                    if m:
-                        vid = m.group(1)
-                    # try glob for files containing the video id or any sanitized text
-                    matches = (
-                        list(glob.glob(os.path.join(out_folder, f"*{vid}*.{fmt}")))
-                        if vid
-                        else []
-                    )
-                    if matches:
-                        skipped.extend(matches)
-                    else:
-                        to_download.append(u)
-            return to_download, skipped
-
-        if (playlist_mode or input_was_file) and Confirm.ask(
-            "Check Downloads folder and skip files that already exist?", default=True
-        ):
-            # for file-loaded lists we treat them like playlists and pass the raw URLs list
+        if streamed is None and (playlist_mode or input_was_file):
+            skip_existing = Confirm.ask(
+                "Check Downloads folder and skip files that already exist?",
+                default=True,
+            )
+        plan["skip_existing"] = skip_existing
+        if streamed is None and skip_existing:
+            index = LibraryIndex(folder, persist=persist_index)
+            # file-loaded lists are checked item by item, each in its own format
             if playlist_mode:
+                selected = [entries[ix - 1] for ix in playlist_indices]
                 to_download, skipped, summary_by_dir = resume_check(
-                    entries, os.path.abspath(folder), fmt, True
+                    selected, os.path.abspath(folder), fmt, True, index, archive
                 )
             else:
                 to_download, skipped, summary_by_dir = resume_check(
-                    urls_to_download, os.path.abspath(folder), fmt, False
+                    urls_to_download,
+                    os.path.abspath(folder),
+                    fmt,
+                    False,
+                    index,
+                    archive,
+                    formats,
                 )
             if skipped:
                 console.print(
@@ -787,9 +4210,47 @@ def main():
             if not proceed:
                 console.print("Download cancelled.")
                 sys.exit(0)
+        timings = []
         try:
             if Confirm.ask("Start download?", default=True):
-                download_task(
+                journal = BatchJournal(
+                    args.journal
+                    or journal_path(urls, os.path.abspath(folder), mode, fmt)
+                )
+                batch = dict(
+                    opts=opts,
+                    mode=mode,
+                    fmt=fmt,
+                    modes=modes,
+                    album=album,
+                    do_lyrics=True,
+                    jobs=jobs,
+                    pipeline=pipeline is not None,
+                    plan=plan,
+                )
+                previous, records = journal.load()
+                resume = None
+                if previous and Confirm.ask(
+                    f"{journal.path} holds an unfinished run of this batch. "
+                    "Continue it, skipping the items it finished?",
+                    default=True,
+                ):
+                    resume = records
+                    urls_to_download = unfinished_items(
+                        batch, records, session, archive
+                    )
+                    playlist_seq = None
+                try:
+                    if resume is not None:
+                        journal.reopen()
+                    else:
+                        journal.start(batch)
+                except JournalBusy:
+                    console.print(
+                        f"[red]Another run of this batch is using {journal.path}.[/red]"
+                    )
+                    sys.exit(EXIT_BUSY)
+                failed = download_task(
                     opts,
                     urls_to_download,
                     summary,
@@ -799,18 +4260,30 @@ def main():
                     playlist_seq,
                     album,
                     True,
+                    jobs=jobs,
+                    session=session,
+                    archive=archive,
+                    pipeline=pipeline,
+                    journal=journal,
+                    resume=resume,
+                    timings=timings,
+                    modes=modes,
                 )
+                journal.close(remove=journal.settled())
         except KeyboardInterrupt:
             console.print("\n[red]Download interrupted by user.[/red]")
+            console.print("Run with --resume to continue where it stopped.")
+            sys.exit(0)
+        finally:
+            session.close()
+            if pipeline:
+                pipeline.close()
+        print_summary(summary, console)
+        export_timings(args.timings, timings, console)
+        try:
+            check_yt_dlp_update(console, updater)
+        except GracefulExit:
             sys.exit(0)
-        table = Table(title="Download Summary")
-        table.add_column("File")
-        table.add_column("Type", justify="center")
-        table.add_column("Status", justify="center")
-        table.add_column("Size", justify="right")
-        for row in summary:
-            table.add_row(*[str(x) if x else "" for x in row])
-        console.print(table)
         again = Confirm.ask("Download another batch?", default=False)
         if not again:
             try: